@@ -0,0 +1,242 @@
+"""Batch Sparkle AI: run the analysis prompt over many texts and write JSONL.
+
+Input is a directory of text files (matched by ``--glob``) or a JSONL file with
+one record per line (``-`` reads stdin). Every item goes through the same
+TextProcessor as the tray app, ``--workers`` at a time, and each result is
+appended to the output as soon as it is ready:
+
+    {"id": "notes/a.txt", "backend": "ollama", "tier": "medium", "response": "...", "elapsed_ms": 2110, "tokens": 183}
+
+With ``--resume`` items already answered in the output file are skipped, so
+an interrupted run picks up where it stopped; failed items are retried.
+
+    python batch.py snippets/ -o annotated.jsonl --workers 4
+    python batch.py records.jsonl --text-field body --id-field uuid -o out.jsonl --resume
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from pathlib import Path
+
+import core
+from core import (AwaitableProcessor, BackendEngine, ConnectivityMonitor, Conversation, ResponseCache, SemanticCache,
+                  CHARS_PER_TOKEN)
+from tracing import log, configure_logging
+
+
+def read_items(source, pattern="*.txt", text_field="text", id_field="id"):
+    """Yield (id, text) from a directory of files or a JSONL file."""
+    if source != "-" and Path(source).is_dir():
+        root = Path(source)
+        for path in sorted(root.rglob(pattern)):
+            if path.is_file():
+                yield path.relative_to(root).as_posix(), path.read_text(encoding="utf-8", errors="replace")
+        return
+
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                log.warning("Skipping line %d: not JSON", number)
+                continue
+            text = record.get(text_field) if isinstance(record, dict) else None
+            if not isinstance(text, str):
+                log.warning("Skipping line %d: no %r string", number, text_field)
+                continue
+            yield str(record.get(id_field, f"line-{number}")), text
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def completed_ids(output):
+    """Ids that already have an answer in ``output``."""
+    done = set()
+    if not output.exists():
+        return done
+    with open(output, encoding="utf-8") as results:
+        for line in results:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if record.get('response') and not record.get('error'):
+                done.add(record['id'])
+    return done
+
+
+class BatchRun:
+    """Runs items on the engine loop with at most ``workers`` in flight.
+
+    Reading items and writing results block, stdin especially, so neither
+    happens on the loop: items are read ahead on a reader thread and each
+    result is written from a worker thread.
+    """
+
+    def __init__(self, engine, output, workers=4, use_gemini=False, cache=None, connectivity=None,
+                 semantic_cache=None):
+        self.engine = engine
+        self.output = output
+        self.workers = workers
+        self.use_gemini = use_gemini
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.connectivity = connectivity
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.tokens = 0
+        self.started_at = None
+        self._write_lock = threading.Lock()
+
+    async def run(self, items, skip=frozenset(), progress_every=25):
+        self.started_at = time.perf_counter()
+        slots = asyncio.Semaphore(self.workers)
+        tasks = set()
+        pending = asyncio.Queue(maxsize=self.workers)
+        # A daemon thread, so an interrupted run does not wait for more input before exiting
+        threading.Thread(target=self._read, args=(items, pending, asyncio.get_running_loop()),
+                         name="BatchReader", daemon=True).start()
+        try:
+            while True:
+                item = await pending.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                item_id, text = item
+                if item_id in skip:
+                    self.skipped += 1
+                    continue
+                if not text.strip():
+                    await asyncio.to_thread(self._write, {'id': item_id, 'error': "empty text"})
+                    self.failed += 1
+                    continue
+                # Reading ahead stops while every worker is busy, so inputs stream through
+                await slots.acquire()
+                task = asyncio.ensure_future(self._process(item_id, text, progress_every))
+                tasks.add(task)
+                task.add_done_callback(lambda task: (tasks.discard(task), slots.release()))
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _read(items, pending, loop):
+        # Puts every item on ``pending``, then None, or the error that stopped the reading
+        end = None
+        try:
+            for item in items:
+                asyncio.run_coroutine_threadsafe(pending.put(item), loop).result()
+        except Exception as error:
+            end = error
+        asyncio.run_coroutine_threadsafe(pending.put(end), loop)
+
+    async def _process(self, item_id, text, progress_every):
+        processor = AwaitableProcessor(Conversation(text), self.engine, use_gemini=self.use_gemini,
+                                       cache=self.cache, connectivity=self.connectivity,
+                                       semantic_cache=self.semantic_cache, source="batch")
+        response = await processor.answer()
+        error = processor.error_message
+        elapsed_ms = round((processor.stopped_at - processor.requested_at) * 1000)
+        if response and not error:
+            tokens = len(response) // CHARS_PER_TOKEN
+            self.tokens += tokens
+            self.processed += 1
+            record = {'id': item_id, 'backend': processor.winner, 'tier': processor.tiers.get(processor.winner),
+                      'response': response, 'elapsed_ms': elapsed_ms, 'tokens': tokens}
+        else:
+            self.failed += 1
+            record = {'id': item_id, 'error': error or "No response received from AI model",
+                      'elapsed_ms': elapsed_ms}
+        await asyncio.to_thread(self._write, record)
+        if (self.processed + self.failed) % progress_every == 0:
+            log.info("Progress: %s", self.summary())
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._write_lock:
+            self.output.write(line)
+            self.output.flush()
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9) if self.started_at else 0.0
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'elapsed_seconds': round(elapsed, 1),
+            'items_per_second': round(self.processed / elapsed, 2) if elapsed else 0.0,
+            'tokens_per_second': round(self.tokens / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="directory of text files, JSONL file, or - for JSONL on stdin")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="JSONL file to write results to")
+    parser.add_argument("--workers", type=int, default=4, help="items processed at once")
+    parser.add_argument("--glob", default="*.txt", help="files to read from an input directory")
+    parser.add_argument("--text-field", default="text", help="JSONL field holding the text")
+    parser.add_argument("--id-field", default="id", help="JSONL field identifying the record")
+    parser.add_argument("--backend", choices=("auto", "ollama"), default="ollama",
+                        help="auto also uses Gemini when it is reachable")
+    parser.add_argument("--resume", action="store_true", help="append, skipping items already answered")
+    parser.add_argument("--overwrite", action="store_true", help="replace an existing output file")
+    parser.add_argument("--cache", action="store_true", help="read and write the response caches")
+    args = parser.parse_args()
+    if args.output.exists() and not (args.resume or args.overwrite):
+        parser.error(f"{args.output} exists; pass --resume to continue it or --overwrite to replace it")
+
+    configure_logging()
+    skip = completed_ids(args.output) if args.resume else set()
+    if skip:
+        log.info("Resuming: %d items already answered", len(skip))
+
+    engine = BackendEngine()
+    # Throughput matters more than the latency of any one item, so never run an item twice
+    engine.router.hedge = False
+    engine.tiers = core.TierPolicy.from_file(core.DATA_DIR / "model_tiers.json")
+    engine.scheduler = core.PriorityScheduler(dict.fromkeys(core.BACKEND_CONCURRENCY, args.workers))
+    engine.start()
+    engine.submit(engine.check_models()).result()
+    use_gemini = args.backend == "auto"
+    connectivity = None
+    if use_gemini:
+        connectivity = ConnectivityMonitor()
+        connectivity.start()
+    cache = ResponseCache() if args.cache else None
+    semantic_cache = SemanticCache() if args.cache else None
+
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as output:
+        batch = BatchRun(engine, output, args.workers, use_gemini=use_gemini, cache=cache,
+                         connectivity=connectivity, semantic_cache=semantic_cache)
+        items = read_items(args.input, args.glob, args.text_field, args.id_field)
+        future = engine.submit(batch.run(items, skip))
+        try:
+            future.result()
+        except KeyboardInterrupt:
+            log.info("Interrupted; rerun with --resume to continue")
+            future.cancel()
+        finally:
+            engine.stop()
+            if cache is not None:
+                cache.close()
+                semantic_cache.close()
+            if connectivity is not None:
+                connectivity.stop()
+
+    print(json.dumps(batch.summary()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
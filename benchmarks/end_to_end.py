@@ -0,0 +1,323 @@
+"""End-to-end latency, GUI cost and memory of streamed answers against mock backends.
+
+Starts the stand-in servers from ``mock_servers.py`` and drives the real
+``TextProcessor`` and ``OverlayWidget`` (offscreen Qt) through them:
+
+- latency: sequential requests per backend; time to first token and end to end
+- stream: long answers rendered into the overlay; GUI-thread time per chunk and
+  resident memory after each answer
+- burst: rapid clipboard events through the ``InputPipeline``, each dispatched
+  text superseding the previous request the way the tray app does
+
+    python benchmarks/end_to_end.py --json > baseline.json
+    python benchmarks/end_to_end.py --compare baseline.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import warnings
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+import core
+from mock_servers import MockGemini, MockOllama
+
+SAMPLE_TEXT = "The quick brown fox jumps over the lazy dog. " * 20
+
+
+def pinned_tiers(backend):
+    """Model tiers of ``backend`` only, so every request goes to it and each backend is measured on its own."""
+    return core.TierPolicy({name: tier for name, tier in core.MODEL_TIERS.items() if tier[0] == backend})
+
+
+def rss_bytes():
+    """Resident set size of this process, or None where it cannot be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def summarize(samples, unit="ms"):
+    if not samples:
+        return {'count': 0}
+    scale = {'ms': 1e3, 'us': 1e6}[unit]
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        f'p50_{unit}': round(ordered[len(ordered) // 2] * scale, 2),
+        f'p90_{unit}': round(ordered[int(len(ordered) * 0.9)] * scale, 2),
+        f'max_{unit}': round(ordered[-1] * scale, 2),
+    }
+
+
+def new_engine(backend, ollama, gemini):
+    engine = core.BackendEngine(ollama_host=ollama.url if ollama else None,
+                                gemini_endpoint=gemini.endpoint if gemini else None)
+    engine.router.hedge = False
+    engine.tiers = pinned_tiers(backend)
+    engine.start()
+    return engine
+
+
+def measure_latency(backend, ollama, gemini, requests):
+    class Recorder(core.TextProcessor):
+        error = None
+
+        def on_error(self, error):
+            self.error = error
+
+    engine = new_engine(backend, ollama, gemini)
+    first_tokens, totals, errors = [], [], 0
+    try:
+        for _ in range(requests):
+            processor = Recorder(core.Conversation(SAMPLE_TEXT), engine, use_gemini=backend == "gemini")
+            processor.start()
+            processor.wait(60000)
+            if processor.error or processor.first_token_at is None:
+                errors += 1
+                continue
+            first_tokens.append(processor.first_token_at - processor.requested_at)
+            totals.append(processor.stopped_at - processor.requested_at)
+    finally:
+        engine.stop()
+    return {
+        'first_token': summarize(first_tokens),
+        'end_to_end': summarize(totals),
+        'errors': errors,
+    }
+
+
+def measure_stream(app, sparkle, ollama, answers):
+    """Render ``answers`` long answers into the overlay, timing the GUI thread."""
+    from PyQt6.QtCore import QEventLoop
+
+    overlay = sparkle.OverlayWidget()
+    overlay.show()
+    gui_seconds = []
+
+    def timed(method):
+        def wrapper(*args):
+            start = time.perf_counter()
+            method(*args)
+            gui_seconds.append(time.perf_counter() - start)
+        return wrapper
+
+    overlay.append_chunk = timed(overlay.append_chunk)
+    overlay.flush_chunks = timed(overlay.flush_chunks)
+    overlay.render_timer.timeout.disconnect()
+    overlay.render_timer.timeout.connect(overlay.flush_chunks)
+
+    chunks = 0
+
+    def count_chunk(content):
+        nonlocal chunks
+        chunks += 1
+
+    engine = new_engine("ollama", ollama, None)
+    rss = [rss_bytes()]
+    start = time.perf_counter()
+    try:
+        for _ in range(answers):
+            overlay.clear_response()
+            processor = sparkle.TextProcessor(core.Conversation(SAMPLE_TEXT), engine)
+            processor.chunk_ready.connect(overlay.append_chunk)
+            processor.chunk_ready.connect(count_chunk)
+            loop = QEventLoop()
+            processor.finished.connect(loop.quit)
+            processor.start()
+            loop.exec()
+            overlay.flush_chunks()
+            gc.collect()
+            rss.append(rss_bytes())
+    finally:
+        engine.stop()
+        overlay.hide()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'answers': answers,
+        'chunks': chunks,
+        'chunks_per_second': round(chunks / elapsed, 1),
+        'gui_us_per_chunk': round(sum(gui_seconds) / max(chunks, 1) * 1e6, 2),
+        'gui_call': summarize(gui_seconds, unit="us"),
+    }
+    if rss[0] is not None:
+        result['rss_mb'] = [round(value / 2**20, 1) for value in rss]
+        # Growth after the first answer has warmed caches points to a leak
+        result['rss_growth_mb'] = round((rss[-1] - rss[1]) / 2**20, 2)
+    return result
+
+
+def measure_burst(app, sparkle, ollama, bursts, burst_size, event_interval_ms, burst_gap_ms):
+    """Fire clipboard bursts through the InputPipeline and count what gets answered."""
+    from PyQt6.QtCore import QEventLoop, QTimer
+
+    engine = new_engine("ollama", ollama, None)
+    overlay = sparkle.OverlayWidget()
+    pipeline = sparkle.InputPipeline()
+    loop = QEventLoop()
+    state = {'current': None, 'started': 0, 'answered': 0, 'done_firing': False}
+    fired_at = {}
+    processors = []
+    settle_latencies = []
+
+    def fire(text):
+        fired_at[text] = time.perf_counter()
+        pipeline.submit(text, "clipboard")
+
+    def handle_input(text, source, trace):
+        # Mirrors AIAssistant.start_processing: a new text supersedes the request in flight
+        if state['current'] is not None:
+            state['current'].stop()
+        overlay.clear_response()
+        processor = sparkle.TextProcessor(core.Conversation(text), engine, trace=trace)
+        processor.chunk_ready.connect(overlay.append_chunk)
+        processor.result_ready.connect(lambda response, p=processor, t=fired_at[text]: answered(p, t))
+        processor.finished.connect(check_done)
+        processors.append(processor)
+        state['current'] = processor
+        state['started'] += 1
+        processor.start()
+
+    def answered(processor, fired):
+        if processor is state['current']:
+            state['answered'] += 1
+            settle_latencies.append(time.perf_counter() - fired)
+
+    def check_done():
+        if state['done_firing'] and all(p.isFinished() for p in processors):
+            loop.quit()
+
+    def finish_firing():
+        state['done_firing'] = True
+        QTimer.singleShot(int(pipeline.debounce_ms * 2), check_done)
+
+    pipeline.text_ready.connect(handle_input)
+    at = 0
+    for burst in range(bursts):
+        for n in range(burst_size):
+            # Distinct enough that the pipeline's minor-edit filter does not drop them
+            text = SAMPLE_TEXT + f" burst {burst} copy {n}" * 5
+            QTimer.singleShot(at, lambda text=text: fire(text))
+            at += event_interval_ms
+        at += burst_gap_ms
+    QTimer.singleShot(at, finish_firing)
+
+    start = time.perf_counter()
+    try:
+        loop.exec()
+    finally:
+        engine.stop()
+    elapsed = time.perf_counter() - start
+    events = bursts * burst_size
+    return {
+        'events': events,
+        'offered_events_per_second': round(events / elapsed, 1),
+        'requests_started': state['started'],
+        'requests_cancelled': state['started'] - state['answered'],
+        'answers': state['answered'],
+        'answers_per_second': round(state['answered'] / elapsed, 2),
+        'pipeline': pipeline.stats(),
+        'copy_to_answer': summarize(settle_latencies),
+    }
+
+
+def run(args):
+    report = {'config': vars(args).copy()}
+    report['config'].pop('compare', None)
+    profile = dict(tokens=args.tokens, tokens_per_second=args.tokens_per_second,
+                   first_token_delay=args.first_token_delay, failure_rate=args.failure_rate,
+                   drop_rate=args.drop_rate)
+
+    # The Qt front end overwrites GOOGLE_API_KEY, so the Gemini runs come first
+    os.environ["GOOGLE_API_KEY"] = "mock"
+    with MockOllama(**profile) as ollama:
+        report['latency'] = {'ollama': measure_latency("ollama", ollama, None, args.requests)}
+        report['mock_ollama'] = ollama.profile.stats()
+    try:
+        with MockGemini(**profile) as gemini:
+            report['latency']['gemini'] = measure_latency("gemini", None, gemini, args.requests)
+            report['mock_gemini'] = gemini.profile.stats()
+    except ImportError as e:
+        report['latency']['gemini'] = {'error': f"mock Gemini unavailable: {str(e)}"}
+
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    import main as sparkle
+
+    with MockOllama(tokens=args.stream_tokens, tokens_per_second=args.stream_tokens_per_second,
+                    first_token_delay=0.05) as ollama:
+        report['stream'] = measure_stream(app, sparkle, ollama, args.stream_answers)
+    with MockOllama(**profile) as ollama:
+        report['burst'] = measure_burst(app, sparkle, ollama, args.bursts, args.burst_size,
+                                        args.event_interval_ms, args.burst_gap_ms)
+        report['burst']['mock_ollama'] = ollama.profile.stats()
+    return report
+
+
+def flatten(report, prefix=""):
+    values = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(baseline, current):
+    old, new = flatten(baseline), flatten(current)
+    print(f"{'metric':<44} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, value in new.items():
+        if name.startswith("config.") or name not in old:
+            continue
+        change = f"{(value - old[name]) / old[name] * 100:+.1f}%" if old[name] else ""
+        print(f"{name:<44} {old[name]:>12} {value:>12} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="latency requests per backend")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per mock answer")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="requests failing before a token")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="streams cut off midway")
+    parser.add_argument("--stream-answers", type=int, default=3)
+    parser.add_argument("--stream-tokens", type=int, default=4000)
+    parser.add_argument("--stream-tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=10)
+    parser.add_argument("--event-interval-ms", type=int, default=30)
+    parser.add_argument("--burst-gap-ms", type=int, default=1500)
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    parser.add_argument("--compare", type=Path, help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    elif args.compare:
+        compare(json.loads(args.compare.read_text()), report)
+    else:
+        for name, value in flatten(report).items():
+            if not name.startswith("config."):
+                print(f"{name:<44} {value:>12}")
+
+
+if __name__ == "__main__":
+    main()
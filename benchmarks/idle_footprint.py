@@ -0,0 +1,133 @@
+"""Resident memory of the tray app when active and idle, and how long it takes to come back.
+
+Drives the real ``AIAssistant`` (offscreen Qt) against ``MockOllama``: a few
+copied texts are answered with the overlay showing, then the assistant is
+toggled off and its idle release runs. Reported:
+
+- RSS at startup, after the answers, and once idle
+- whether Ollama was asked to unload the model (``keep_alive=0``)
+- reactivation: the toggle itself, the model warmup it starts, and the first
+  copied text after it (the overlay is rebuilt then) to its first token
+
+    python benchmarks/idle_footprint.py --answers 20
+"""
+import argparse
+import functools
+import gc
+import os
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+from PyQt6.QtCore import QEventLoop, QTimer
+from PyQt6.QtWidgets import QApplication
+
+import core
+from end_to_end import rss_bytes
+from mock_servers import MockOllama
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("condition not reached")
+        loop = QEventLoop()
+        QTimer.singleShot(5, loop.quit)
+        loop.exec()
+
+
+def settle(ms=200):
+    loop = QEventLoop()
+    QTimer.singleShot(ms, loop.quit)
+    loop.exec()
+    gc.collect()
+
+
+def megabytes(value):
+    return None if value is None else round(value / 2**20, 1)
+
+
+def run(args, data_dir):
+    import keyboard
+    import main as sparkle
+    from tracing import tracer
+
+    # The global hotkey needs an input device and is not part of what is measured
+    keyboard.add_hotkey = lambda *args, **kwargs: None
+    keyboard.unhook_all = lambda: None
+    # Caches and history go to a scratch directory rather than ~/.sparkience
+    core.DATA_DIR = data_dir
+    sparkle.ResponseCache = functools.partial(core.ResponseCache, path=data_dir / "response_cache.sqlite3")
+    sparkle.SemanticCache = functools.partial(core.SemanticCache, path=data_dir / "semantic_cache.npz")
+
+    report = {}
+    with MockOllama(tokens=args.tokens, tokens_per_second=args.tokens_per_second,
+                    first_token_delay=args.first_token_delay) as ollama:
+        os.environ["OLLAMA_HOST"] = ollama.url
+        assistant = sparkle.AIAssistant()
+        assistant.speculative = False
+        wait_until(lambda: assistant.model_status == "Model ready")
+        settle()
+        report['rss_startup_mb'] = megabytes(rss_bytes())
+
+        for i in range(args.answers):
+            text = f"Question {i}: explain how a {i}-stage pipeline overlaps fetch, decode and execute."
+            assistant.handle_input(text, "clipboard", tracer.start("clipboard"))
+            wait_until(lambda: assistant.text_processor is None and assistant.overlay.current_response == "")
+        settle()
+        report['rss_active_mb'] = megabytes(rss_bytes())
+
+        unloads_before = sum(1 for path, body in ollama.bodies if body.get('keep_alive') == 0)
+        assistant.toggle_assistant()
+        assistant.idle_timer.stop()
+        assistant.release_resources()
+        settle(500)
+        report['rss_idle_mb'] = megabytes(rss_bytes())
+        report['model_unload_requests'] = sum(
+            1 for path, body in ollama.bodies if body.get('keep_alive') == 0) - unloads_before
+
+        start = time.perf_counter()
+        assistant.toggle_assistant()
+        report['reactivate_toggle_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        wait_until(lambda: assistant.model_status == "Model ready")
+        report['reactivate_model_ready_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+        trace = tracer.start("clipboard")
+        start = time.perf_counter()
+        assistant.handle_input("How does a branch predictor recover from a misprediction?", "clipboard", trace)
+        report['overlay_rebuild_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        wait_until(lambda: any(stage == "first_token" for stage, _, _ in trace.stages))
+        report['first_token_after_reactivate_ms'] = round(
+            next(at for stage, at, _ in trace.stages if stage == "first_token") * 1000, 1)
+        wait_until(lambda: assistant.text_processor is None)
+        settle()
+        report['rss_reactivated_mb'] = megabytes(rss_bytes())
+        assistant.cleanup_and_exit()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answers", type=int, default=20, help="copied texts answered before going idle")
+    parser.add_argument("--tokens", type=int, default=300, help="tokens per mock answer")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.05, help="seconds")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    with tempfile.TemporaryDirectory(prefix="sparkle-idle-") as data_dir:
+        report = run(args, Path(data_dir))
+    for name, value in report.items():
+        print(f"{name:<36} {value:>10}")
+    del app
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Which copied texts the input filter drops as secrets, and how long a check takes.
+
+Each case is classified with the default rules:
+
+- code that fetches a credential (calls, subscripts, attribute access) and
+  identifiers that merely contain a word like "token" must be sent
+- literal passwords, keys and tokens must be dropped as ``secret``
+
+Exits with status 1 if any case is classified wrongly. Check latency is
+measured on a typical copy and on a large CSV.
+
+    python benchmarks/input_filter.py
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from prefilter import DROP, InputFilter
+
+SHOULD_SEND = [
+    'password = request.form["password"]',
+    "self.token = token_provider.fetch_token()",
+    'api_key: os.environ["OPENAI_API_KEY"]',
+    "secret = generate_secret()",
+    "api_key=settings.OPENAI_API_KEY",
+    'token = f"{prefix}{suffix}"',
+    'DB_PASSWORD="${DB_PASSWORD}"',
+    'password: "must be at least eight characters"',
+    "AbstractSingletonProxyFactoryBeanDefinitionRegistryPostProcessor",
+    "Map<String,List<Int32>>",
+    "x=Foo(1);y=Bar[2]",
+]
+
+SHOULD_DROP = [
+    'password = "hunter2hunter2"',
+    "API_KEY='a8f5f167f44f4964e6c998dee827110c'",
+    "password=Tr0ub4dor&3x",
+    '{"password": "s3cr3t-Passw0rd"}',
+    "token: 8f14e45fceea167a5a36dedd4bea2543",
+    "ghp_" + "a1B2c3D4e5F6g7H8i9J0k1L2m3N4o5P6q7R8",
+]
+
+
+def check_cases(input_filter, cases, expect_secret):
+    failures = []
+    for text in cases:
+        action, category, _ = input_filter.check(text)
+        secret = action == DROP and category == 'secret'
+        status = "ok" if secret == expect_secret else "WRONG"
+        print(f"{status:<6} {category:<10} {action:<5} {text[:60]!r}")
+        if secret != expect_secret:
+            failures.append(text)
+    return failures
+
+
+def timed(input_filter, text, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        input_filter.check(text)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    input_filter = InputFilter()
+    failures = check_cases(input_filter, SHOULD_SEND, False) + check_cases(input_filter, SHOULD_DROP, True)
+
+    typical = "TypeError: unsupported operand type(s) for +: 'int' and 'str' in handlers.py line 48"
+    csv = "\n".join(f"{i},item-{i},{i * 0.5:.2f},ok" for i in range(200000))
+    print(f"typical copy: {timed(input_filter, typical, args.runs):.0f} us")
+    print(f"{len(csv) / 1e6:.1f} MB CSV: {timed(input_filter, csv, 10):.0f} us")
+
+    if failures:
+        print(f"{len(failures)} case(s) classified wrongly", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
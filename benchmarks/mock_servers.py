@@ -0,0 +1,323 @@
+"""Local stand-ins for the Ollama and Gemini streaming APIs.
+
+``MockOllama`` speaks Ollama's HTTP ``/api/chat`` (newline-delimited JSON, or
+one JSON body with ``"stream": false``), ``/api/generate`` and ``/api/tags``;
+models outside ``models`` get Ollama's 404. ``MockGemini``
+serves the v1beta ``GenerativeService`` ``StreamGenerateContent`` and
+``GenerateContent`` RPCs over TLS, which is what ChatGoogleGenerativeAI's async
+client calls. Both produce ``tokens`` tokens at ``tokens_per_second`` after
+``first_token_delay`` seconds and can inject failures:
+
+- ``failure_rate``: fraction of requests rejected before the first token
+- ``drop_rate``: fraction of streams cut off at a random token
+
+    with MockOllama(tokens_per_second=80) as ollama:
+        engine = core.BackendEngine(ollama_host=ollama.url)
+"""
+import datetime
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+PARAGRAPH_TOKENS = 40
+
+
+class StreamProfile:
+    """Latency, token rate and failure injection shared by both mock servers."""
+
+    def __init__(self, tokens=200, tokens_per_second=50.0, first_token_delay=0.2,
+                 failure_rate=0.0, drop_rate=0.0, seed=0):
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.requests = 0
+        self.failures = 0
+        self.drops = 0
+        self.disconnects = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def plan(self):
+        """Decide the fate of the next request: returns (fail, drop_at_token)."""
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.failure_rate:
+                self.failures += 1
+                return True, None
+            if self._random.random() < self.drop_rate:
+                self.drops += 1
+                return False, self._random.randrange(1, self.tokens)
+            return False, None
+
+    def chunks(self, drop_at=None, tokens_per_chunk=1):
+        """Yield text chunks on schedule, stopping early at ``drop_at``."""
+        last = self.tokens if drop_at is None else drop_at
+        start = time.perf_counter() + self.first_token_delay
+        for first in range(0, last, tokens_per_chunk):
+            due = start + first / self.tokens_per_second
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield "".join(token_at(i) for i in range(first, min(first + tokens_per_chunk, last)))
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'drops': self.drops,
+            'disconnects': self.disconnects,
+        }
+
+
+def token_at(i):
+    # Model output arrives a word at a time with a paragraph break every so often
+    return "token\n\n" if i % PARAGRAPH_TOKENS == PARAGRAPH_TOKENS - 1 else "token "
+
+
+class MockOllama:
+    """Threaded HTTP server answering ``/api/chat``, ``/api/generate`` and ``/api/tags``."""
+
+    def __init__(self, profile=None, models=("llama3.2:1b", "llama3.2:3b", "nomic-embed-text:latest"),
+                 **profile_options):
+        self.profile = profile or StreamProfile(**profile_options)
+        self.models = models
+        self.bodies = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json(200, {"models": [{"name": model, "model": model} for model in mock.models]})
+                else:
+                    self._send_json(404, {"error": f"unknown path {self.path}"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                mock.bodies.append((self.path, body))
+                model = body.get("model")
+                if model is not None and model not in mock.models and f"{model}:latest" not in mock.models:
+                    self._send_json(404, {"error": f"model '{model}' not found"})
+                elif self.path == "/api/generate":
+                    self._send_json(200, {"model": body.get("model"), "response": "", "done": True,
+                                          "load_duration": 0})
+                elif self.path == "/api/chat":
+                    self._chat(body)
+                else:
+                    self._send_json(404, {"error": f"unknown path {self.path}"})
+
+            def _chat(self, body):
+                fail, drop_at = mock.profile.plan()
+                if fail:
+                    self._send_json(500, {"error": "injected failure"})
+                    return
+                if body.get("stream") is False:
+                    content = "".join(mock.profile.chunks(drop_at))
+                    if drop_at is not None:
+                        self._send_json(500, {"error": "injected disconnect"})
+                        return
+                    try:
+                        self._send_json(200, {"model": body.get("model"),
+                                              "message": {"role": "assistant", "content": content}, "done": True})
+                    except (BrokenPipeError, ConnectionResetError):
+                        mock.profile.disconnects += 1
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                started = time.perf_counter()
+                try:
+                    count = 0
+                    for count, text in enumerate(mock.profile.chunks(drop_at), start=1):
+                        self._write_line({"model": body.get("model"),
+                                          "message": {"role": "assistant", "content": text}, "done": False})
+                    if drop_at is not None:
+                        # Cut the connection without the terminating chunk
+                        self.close_connection = True
+                        return
+                    self._write_line({"model": body.get("model"),
+                                      "message": {"role": "assistant", "content": ""}, "done": True,
+                                      "load_duration": 0, "eval_count": count,
+                                      "eval_duration": int((time.perf_counter() - started) * 1e9)})
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    mock.profile.disconnects += 1
+                    self.close_connection = True
+
+            def _write_line(self, payload):
+                line = json.dumps(payload).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class MockGemini:
+    """gRPC server implementing ``GenerativeService`` (streamed and unary generation).
+
+    The Gemini client only connects over TLS, so the server uses a throwaway
+    self-signed certificate for ``localhost`` and ``start()`` points gRPC's
+    default trust store (``GRPC_DEFAULT_SSL_ROOTS_FILE_PATH``) at it. Call it
+    before the first Gemini request in the process. Needs ``cryptography``.
+    """
+
+    SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+    def __init__(self, profile=None, tokens_per_chunk=4, **profile_options):
+        self.profile = profile or StreamProfile(**profile_options)
+        self.tokens_per_chunk = tokens_per_chunk
+        self.port = None
+        self._server = None
+        self._cert_dir = None
+
+    @property
+    def endpoint(self):
+        return f"localhost:{self.port}"
+
+    def start(self):
+        import grpc
+        from google.ai.generativelanguage_v1beta.types import GenerateContentRequest, GenerateContentResponse
+
+        self._cert_dir = tempfile.TemporaryDirectory(prefix="sparkle-mock-gemini-")
+        cert_pem, key_pem = self_signed_certificate("localhost")
+        roots_path = Path(self._cert_dir.name) / "roots.pem"
+        roots_path.write_bytes(cert_pem)
+        os.environ["GRPC_DEFAULT_SSL_ROOTS_FILE_PATH"] = str(roots_path)
+
+        handler = grpc.method_handlers_generic_handler(self.SERVICE, {
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self._stream,
+                request_deserializer=GenerateContentRequest.deserialize,
+                response_serializer=GenerateContentResponse.serialize,
+            ),
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self._generate,
+                request_deserializer=GenerateContentRequest.deserialize,
+                response_serializer=GenerateContentResponse.serialize,
+            ),
+        })
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+        self._server.add_generic_rpc_handlers((handler,))
+        credentials = grpc.ssl_server_credentials([(key_pem, cert_pem)])
+        self.port = self._server.add_secure_port("localhost:0", credentials)
+        self._server.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop(grace=None)
+        if self._cert_dir is not None:
+            self._cert_dir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def _response(text, finish_reason=None):
+        from google.ai.generativelanguage_v1beta.types import Candidate, Content, GenerateContentResponse, Part
+
+        candidate = Candidate(content=Content(parts=[Part(text=text)], role="model"), index=0)
+        if finish_reason is not None:
+            candidate.finish_reason = finish_reason
+        return GenerateContentResponse(candidates=[candidate])
+
+    def _generate(self, request, context):
+        import grpc
+        from google.ai.generativelanguage_v1beta.types import Candidate
+
+        fail, drop_at = self.profile.plan()
+        if fail or drop_at is not None:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "injected failure")
+        return self._response("".join(self.profile.chunks()), Candidate.FinishReason.STOP)
+
+    def _stream(self, request, context):
+        import grpc
+        from google.ai.generativelanguage_v1beta.types import Candidate
+
+        response = self._response
+        fail, drop_at = self.profile.plan()
+        if fail:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "injected failure")
+        for text in self.profile.chunks(drop_at, self.tokens_per_chunk):
+            if not context.is_active():
+                self.profile.disconnects += 1
+                return
+            yield response(text)
+        if drop_at is not None:
+            context.abort(grpc.StatusCode.INTERNAL, "injected disconnect")
+        yield response("", Candidate.FinishReason.STOP)
+
+
+def self_signed_certificate(hostname):
+    """Return (cert_pem, key_pem) for a one-day self-signed ``hostname`` certificate."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(hostname)]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    return cert.public_bytes(serialization.Encoding.PEM), key_pem
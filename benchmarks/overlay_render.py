@@ -0,0 +1,161 @@
+"""Measure GUI-thread cost per streamed chunk in OverlayWidget as a response grows.
+
+Runs under the offscreen Qt platform. Chunks are fed in frames the way the
+backend stream delivers them, and the time spent in ``append_chunk`` plus the
+per-frame flush is reported per bucket of response length. For comparison the
+old path (``QLabel.setText`` on the whole response for every chunk, followed by
+the word-wrap layout the scroll area asked for) is timed too.
+
+``--turns`` also plays a long chat session into the conversation view and
+reports, per bucket of turns, the cost of one turn (question plus streamed
+answer), of scrolling through the loaded history, of a resize, and the
+resident memory, all of which should stay flat as history is paged to disk.
+
+    python benchmarks/overlay_render.py --chunks 4000
+    python benchmarks/overlay_render.py --turns 500
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PyQt6.QtWidgets import QApplication, QLabel
+
+import main as sparkle
+from end_to_end import rss_bytes
+
+PARAGRAPH_TOKENS = 40
+
+
+def chunk_at(i):
+    # Model output arrives a word at a time with a paragraph break every so often
+    return "token\n\n" if i % PARAGRAPH_TOKENS == 0 else "token "
+
+
+def measure_overlay(app, chunks, chunks_per_frame, bucket_size):
+    overlay = sparkle.OverlayWidget()
+    overlay.show()
+    overlay.clear_response()
+
+    buckets = []
+    elapsed = 0.0
+    for i in range(1, chunks + 1):
+        start = time.perf_counter()
+        overlay.append_chunk(chunk_at(i))
+        if i % chunks_per_frame == 0:
+            overlay.flush_chunks()
+        elapsed += time.perf_counter() - start
+        app.processEvents()
+        if i % bucket_size == 0:
+            buckets.append(elapsed / bucket_size)
+            elapsed = 0.0
+    overlay.hide()
+    return buckets
+
+
+def measure_label(app, chunks, bucket_size):
+    label = QLabel()
+    label.setWordWrap(True)
+    label.setFixedWidth(440)
+    label.show()
+
+    buckets = []
+    elapsed = 0.0
+    response = ""
+    for i in range(1, chunks + 1):
+        start = time.perf_counter()
+        response += chunk_at(i)
+        label.setText(response)
+        label.heightForWidth(label.width())
+        elapsed += time.perf_counter() - start
+        app.processEvents()
+        if i % bucket_size == 0:
+            buckets.append(elapsed / bucket_size)
+            elapsed = 0.0
+    label.hide()
+    return buckets
+
+
+def measure_history(app, turns, answer_chunks, bucket_size):
+    overlay = sparkle.OverlayWidget()
+    overlay.show()
+    view = overlay.conversation_view
+    scroll_bar = view.verticalScrollBar()
+
+    rows = []
+    turn_seconds, scroll_seconds, resize_seconds = 0.0, 0.0, 0.0
+    for turn in range(1, turns + 1):
+        start = time.perf_counter()
+        overlay.add_message("user", f"Follow-up question number {turn} about the previous answer?")
+        for i in range(1, answer_chunks + 1):
+            overlay.append_chunk(chunk_at(i))
+            if i % 4 == 0:
+                overlay.flush_chunks()
+        overlay.set_response(overlay.current_response)
+        app.processEvents()
+        turn_seconds += time.perf_counter() - start
+
+        if turn % bucket_size == 0:
+            # Sweep the loaded rows from bottom to top and back, painting each position
+            start = time.perf_counter()
+            step = max(1, view.viewport().height())
+            positions = list(range(scroll_bar.maximum(), scroll_bar.minimum(), -step))
+            for value in positions + positions[::-1]:
+                scroll_bar.setValue(value)
+                view.viewport().repaint()
+            scroll_seconds = (time.perf_counter() - start) / max(1, 2 * len(positions))
+            view.scrollToBottom()
+
+            start = time.perf_counter()
+            for width in (460, 500):
+                overlay.container.setFixedSize(width, 400)
+                app.processEvents()
+                view.viewport().repaint()
+            resize_seconds = (time.perf_counter() - start) / 2
+            overlay.container.setFixedSize(500, 400)
+
+            gc.collect()
+            rss = rss_bytes()
+            rows.append((turn, turn_seconds / bucket_size, scroll_seconds, resize_seconds,
+                         overlay.history.rowCount(), rss))
+            turn_seconds = 0.0
+    overlay.hide()
+    overlay.history.store.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=4000)
+    parser.add_argument("--chunks-per-frame", type=int, default=4)
+    parser.add_argument("--bucket-size", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=0, help="chat turns to play into the conversation view")
+    parser.add_argument("--answer-chunks", type=int, default=200, help="streamed chunks per answer")
+    parser.add_argument("--turn-bucket", type=int, default=50)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    overlay = measure_overlay(app, args.chunks, args.chunks_per_frame, args.bucket_size)
+    label = measure_label(app, args.chunks, args.bucket_size)
+
+    print(f"{'response chars':>15} {'overlay us/chunk':>17} {'setText us/chunk':>17}")
+    for n, (new, old) in enumerate(zip(overlay, label), start=1):
+        chars = sum(len(chunk_at(i)) for i in range(1, n * args.bucket_size + 1))
+        print(f"{chars:>15} {new * 1e6:>17.1f} {old * 1e6:>17.1f}")
+
+    if args.turns:
+        print()
+        print(f"{'turns':>6} {'ms/turn':>8} {'scroll ms':>10} {'resize ms':>10} {'rows':>5} {'RSS MB':>7}")
+        for turn, per_turn, scroll, resize, loaded, rss in measure_history(app, args.turns, args.answer_chunks,
+                                                                             args.turn_bucket):
+            memory = f"{rss / 2**20:>7.1f}" if rss is not None else f"{'n/a':>7}"
+            print(f"{turn:>6} {per_turn * 1e3:>8.2f} {scroll * 1e3:>10.2f} {resize * 1e3:>10.2f} {loaded:>5} {memory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Which near-duplicate texts the semantic cache answers from, and how fast it searches.
+
+Uses the hashed trigram embedding (no Ollama needed). Each pair stores an
+answer for the first text and looks up the second:
+
+- pairs that only differ in noise (line numbers, file positions, addresses,
+  whitespace) must hit
+- pairs that differ in a number that changes the question (error codes,
+  file modes, versions), in an operator or in a negation must miss, however
+  similar their trigrams are
+
+Exits with status 1 if any pair does not behave as expected. Search latency is
+measured against an index of ``--entries`` answers.
+
+    python benchmarks/semantic_cache.py --entries 20000
+"""
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import core
+
+TRACE = '''Traceback (most recent call last):
+  File "/srv/app/handlers.py", line {a}, in dispatch
+    return self.routes[path](request)
+  File "/srv/app/views.py", line {b}, in detail
+    item = Item.objects.get(pk=pk)
+KeyError: 'pk' at 0x{addr}'''
+
+CHECK = """def check(order, limit):
+    if order.total {op} limit:
+        raise ValueError("order total exceeds the configured limit for this customer")
+    return order"""
+
+PAY = """def pay(employee, bonus):
+    salary = employee.base_salary
+    salary {op} bonus
+    return round(salary * employee.tax_rate, 2)"""
+
+SHOULD_HIT = [
+    (TRACE.format(a=112, b=48, addr="7f3a1c2b9d40"), TRACE.format(a=131, b=52, addr="7f88e0a41f10")),
+    ("views.py:48:12: error: Argument 1 has incompatible type", "views.py:61:3: error: Argument 1 has incompatible type"),
+    ("The quick brown fox jumps over the lazy dog.", "The quick  brown fox\njumps over the lazy dog."),
+]
+
+SHOULD_MISS = [
+    ("HTTP error 404 Not Found", "HTTP error 500 Not Found"),
+    ("chmod 755 file.sh", "chmod 644 file.sh"),
+    ("What changed between Python 3.11 and 3.12?", "What changed between Python 3.12 and 3.13?"),
+    ("Exit code 137 from the container", "Exit code 139 from the container"),
+    # Trigram vectors of these score 0.97-0.99, well above any usable cosine threshold
+    ("Please confirm with the platform team that this new dependency is safe to upgrade in production.",
+     "Please confirm with the platform team that this new dependency is unsafe to upgrade in production."),
+    (CHECK.format(op=">"), CHECK.format(op="<")),
+    (PAY.format(op="-="), PAY.format(op="+=")),
+    ("The nightly cleanup job should not delete files in the shared uploads directory older than thirty days.",
+     "The nightly cleanup job should delete files in the shared uploads directory older than thirty days."),
+]
+
+
+def filler(rng, words=12):
+    vocabulary = "cache index vector request answer model token stream backend queue thread overlay".split()
+    return " ".join(rng.choice(vocabulary) for _ in range(words)) + f" {rng.randrange(10**6)}"
+
+
+async def embed(cache, text):
+    return await cache.embed(None, text)
+
+
+def check_pairs(cache, pairs, expect_hit):
+    failures = []
+    for i, (stored, asked) in enumerate(pairs):
+        namespace = f"check:{expect_hit}:{i}"
+        cache.add(asyncio.run(embed(cache, stored)), namespace, f"answer {i}")
+        hit = cache.search(asyncio.run(embed(cache, asked)), namespace) is not None
+        similarity = float(core.hashed_embedding(stored) @ core.hashed_embedding(asked))
+        status = "ok" if hit == expect_hit else "WRONG"
+        print(f"{status:<6} {'hit' if hit else 'miss':<5} similarity {similarity:.3f}  {asked[:60]!r}")
+        if hit != expect_hit:
+            failures.append(asked)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=20000, help="answers in the index searched for latency")
+    parser.add_argument("--searches", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="sparkle-semantic-") as data_dir:
+        cache = core.SemanticCache(path=Path(data_dir) / "semantic_cache.npz", use_ollama=False,
+                                   max_entries=max(args.entries, 1))
+        failures = check_pairs(cache, SHOULD_HIT, True) + check_pairs(cache, SHOULD_MISS, False)
+
+        rng = random.Random(0)
+        for i in range(args.entries):
+            cache.add(asyncio.run(embed(cache, filler(rng))), "latency", f"answer {i}")
+        queries = [asyncio.run(embed(cache, filler(rng))) for _ in range(args.searches)]
+        start = time.perf_counter()
+        for query in queries:
+            cache.search(query, "latency")
+        elapsed = time.perf_counter() - start
+        print(f"search over {args.entries} entries: {elapsed / args.searches * 1000:.2f} ms")
+
+    if failures:
+        print(f"{len(failures)} pair(s) answered wrongly", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
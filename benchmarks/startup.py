@@ -0,0 +1,95 @@
+"""Cold-start import cost of the tray app and of the GUI-free core.
+
+Each target is imported in a fresh interpreter with ``python -X importtime``.
+The report shows the wall time above an empty interpreter and the heaviest
+packages by import time (each module's own time, summed per root package).
+
+    python benchmarks/startup.py --runs 5 --top 10
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TARGETS = {
+    "core": "import core",
+    "core + ollama backend": "import core; core.BackendEngine().ollama_client()",
+    "core + gemini backend": "import core, langchain_google_genai, langchain_core.messages",
+    "tray app": "import main",
+}
+
+
+def run_once(statement):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return elapsed, parse_importtime(result.stderr)
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:   self |   cumulative | <indent>module"; summing each
+    # module's self time under its root package gives a breakdown without double counting
+    packages = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line.split("|")
+        packages[name.strip().split(".")[0]] += int(self_us.split(":")[1])
+    return packages
+
+
+def measure(statement, runs):
+    best_elapsed, best_packages = None, None
+    for _ in range(runs):
+        elapsed, packages = run_once(statement)
+        if best_elapsed is None or elapsed < best_elapsed:
+            best_elapsed, best_packages = elapsed, packages
+    return best_elapsed, best_packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="best of N fresh interpreters")
+    parser.add_argument("--top", type=int, default=10, help="packages to list per target")
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+
+    baseline, interpreter_packages = measure("pass", args.runs)
+    report = {}
+    for label, statement in TARGETS.items():
+        try:
+            elapsed, packages = measure(statement, args.runs)
+        except RuntimeError as e:
+            report[label] = {"error": str(e)}
+            continue
+        packages = {name: us for name, us in packages.items() if name not in interpreter_packages}
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        report[label] = {
+            "wall_ms": round((elapsed - baseline) * 1000, 1),
+            "packages_ms": {name: round(us / 1000, 1) for name, us in heaviest},
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for label, result in report.items():
+        if "error" in result:
+            print(f"{label}: failed ({result['error']})\n")
+            continue
+        print(f"{label}: {result['wall_ms']:.0f} ms above an empty interpreter")
+        for name, ms in result["packages_ms"].items():
+            print(f"    {name:<28} {ms:>8.1f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2064 @@
+"""Processing core for Sparkle AI: backends, prompt building and request handling.
+
+Nothing in here depends on Qt or Windows, and each backend client library is
+imported the first time that backend is used, so the core can run headless
+(and start quickly) on any platform.
+"""
+import os
+import re
+import time
+import json
+import hashlib
+import sqlite3
+import asyncio
+import threading
+import statistics
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from prefilter import is_structured
+from tracing import log, metrics, tracer
+
+
+OLLAMA_MODEL = 'llama3.2:3b'
+# How long Ollama keeps the model loaded after the last request or warmup
+OLLAMA_KEEP_ALIVE = "30m"
+GEMINI_MODEL = "models/gemini-1.5-flash"
+OLLAMA_PROMPT_TEMPLATE = "Analyze this text and provide a relevant explanation: {text}"
+GEMINI_PROMPT_TEMPLATE = """
+            Analyze the following text and provide a relevant explanation. 
+            If the text appears to be from a casual context, provide a conversational response.
+            If the text is technical or formal, provide a concise, professional explanation.
+            
+            Text to analyze: {text}
+            """
+
+# Single words and short phrases get a short answer
+QUICK_PROMPT_TEMPLATE = "Briefly explain this in one or two sentences: {text}"
+QUICK_ANSWER_TOKENS = 120
+
+BACKEND_MODELS = {
+    'ollama': (OLLAMA_MODEL, OLLAMA_PROMPT_TEMPLATE),
+    'gemini': (GEMINI_MODEL, GEMINI_PROMPT_TEMPLATE),
+}
+
+# First-token latency (s) and generation speed (tokens/s) assumed until a backend has been measured
+BACKEND_PRIORS = {
+    'ollama': (1.5, 25.0),
+    'gemini': (1.0, 60.0),
+}
+
+# Model tiers from fastest to strongest: backend, model and the most tokens an answer may take
+MODEL_TIERS = {
+    'small': ('ollama', 'llama3.2:1b', 256),
+    'medium': ('ollama', OLLAMA_MODEL, 768),
+    'remote': ('gemini', GEMINI_MODEL, 1024),
+}
+TIER_PRIORS = {
+    'small': (1.0, 50.0),
+    'medium': BACKEND_PRIORS['ollama'],
+    'remote': BACKEND_PRIORS['gemini'],
+}
+# Texts up to this long can be answered by the fastest tier, longer ones need the strongest
+SHORT_TEXT_CHARS = 280
+LONG_TEXT_CHARS = 4000
+CODE_LINE_PATTERN = re.compile(
+    r"^\s*(?:def |class |import |from \S+ import |function |return\b|#include|public |private |const |let |var |fn |func )"
+    r"|[;{}]\s*$"
+)
+
+# Request classes, most urgent first: a follow-up typed in the overlay, a copied
+# text, and work nobody is waiting for yet (selections answered ahead of time,
+# texts queued while offline)
+CHAT = "chat"
+COPY = "copy"
+SPECULATIVE = "speculative"
+PRIORITY_CLASSES = (CHAT, COPY, SPECULATIVE)
+# Streams each backend runs at once; a local Ollama generates on one GPU
+BACKEND_CONCURRENCY = {
+    'ollama': 1,
+    'gemini': 4,
+}
+
+GEMINI_HEALTH_URL = "https://generativelanguage.googleapis.com/"
+
+DATA_DIR = Path.home() / ".sparkience"
+
+# Near-duplicate inputs reuse an answer when their model embeddings are this similar (cosine).
+# Trigram vectors score 0.96 for "safe"/"unsafe" and 0.99 for "<"/">", so hashed ones must match exactly.
+EMBED_MODEL = "nomic-embed-text"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+HASHED_EMBEDDING_DIM = 256
+# Numbers that differ between otherwise identical texts without changing their meaning:
+# line numbers, file positions (main.py:12:5) and memory addresses
+NOISE_NUMBER_PATTERN = re.compile(r"\bline \d+|\.[a-z]{1,5}:\d+(?::\d+)?|\b0x[0-9a-f]+", re.IGNORECASE)
+
+# Follow-up context is budgeted in estimated tokens (~4 characters each)
+CHARS_PER_TOKEN = 4
+CONTEXT_TOKEN_BUDGET = 3000
+
+# Copied text beyond ~3000 tokens is summarized part by part (map) and the
+# answer is written from those notes (reduce), a few parts at a time
+LARGE_INPUT_CHARS = 12000
+MAP_CHUNK_CHARS = 4000
+MAP_CHUNK_OVERLAP = 200
+MAP_WORKERS = 3
+MAP_NOTE_TOKENS = 200
+MAP_MAX_ROUNDS = 3
+MAP_PROMPT_TEMPLATE = (
+    "This is part {index} of {count} of a longer text. "
+    "Summarize the key points of this part concisely:\n\n{text}"
+)
+DIGEST_PROMPT_TEMPLATE = (
+    "The following are notes on consecutive parts of a longer text. Using them, analyze the "
+    "text as a whole and provide a relevant explanation:\n\n{notes}"
+)
+
+# How long pooled backend connections are kept open between requests
+HTTP_KEEPALIVE_SECONDS = 120
+
+
+class ResponseCache:
+    """Two-tier cache of model answers: an in-memory LRU in front of SQLite.
+
+    Entries are keyed on the normalized input text, backend, model name and
+    prompt template, and expire after ``ttl_seconds``. Both tiers are bounded;
+    the least recently used entries are evicted first.
+    """
+
+    def __init__(self, path=DATA_DIR / "response_cache.sqlite3", max_memory_entries=128,
+                 max_disk_entries=5000, ttl_seconds=7 * 24 * 60 * 60):
+        self.path = Path(path)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+        except (OSError, sqlite3.Error) as e:
+            log.warning("Response cache running memory-only: %s", e)
+            self._db = None
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    @staticmethod
+    def make_key(text, backend, model, prompt_template):
+        normalized = " ".join(text.split())
+        payload = json.dumps([normalized, backend, model, prompt_template])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, response = entry
+                if now - created < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._memory[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT response, created FROM responses WHERE key = ? AND created > ?",
+                        (key, now - self.ttl_seconds)
+                    ).fetchone()
+                    if row is not None:
+                        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        response, created = row
+                        self._remember(key, created, response)
+                        self.disk_hits += 1
+                        return response
+                except sqlite3.Error as e:
+                    log.warning("Response cache read failed: %s", e)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+                self._db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl_seconds,))
+                self._db.execute("""
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_disk_entries,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                log.warning("Response cache write failed: %s", e)
+
+    def _remember(self, key, created, response):
+        self._memory[key] = (created, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def fold_noise_numbers(text):
+    def fold(match):
+        value = match.group()
+        return "0x0" if value[:2].lower() == "0x" else re.sub(r'\d+', '0', value)
+    return NOISE_NUMBER_PATTERN.sub(fold, text)
+
+
+def fold_text(text):
+    """``text`` with case, whitespace and noise numbers folded away."""
+    return fold_noise_numbers(" ".join(text.lower().split()))
+
+
+def _fingerprint(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little', signed=True)
+
+
+def number_signature(text):
+    """64-bit fingerprint of the numbers in ``text`` that carry meaning (error codes, modes, versions)."""
+    return _fingerprint(" ".join(re.findall(r'\d+', NOISE_NUMBER_PATTERN.sub(' ', text))))
+
+
+def folded_signature(text):
+    """64-bit fingerprint of ``fold_text(text)``; texts with equal ones differ only in noise."""
+    return _fingerprint(fold_text(text))
+
+
+def hashed_embedding(text, dim=HASHED_EMBEDDING_DIM):
+    """Unit vector of hashed character trigrams; cheap, and needs no model.
+
+    Case, whitespace and noise numbers (line numbers, file positions,
+    addresses) are folded first, so the same stack trace with other line
+    numbers or reflowed text maps to (nearly) the same vector.
+    """
+    import numpy as np
+    normalized = fold_text(text)
+    data = np.frombuffer(normalized.encode('utf-8') or b' ', dtype=np.uint8).astype(np.uint64)
+    if len(data) < 3:
+        data = np.pad(data, (0, 3 - len(data)), constant_values=32)
+    grams = (data[:-2] << np.uint64(16)) | (data[1:-1] << np.uint64(8)) | data[2:]
+    hashes = (grams * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+    # A sign bit from the same hash keeps bucket collisions from only ever adding up
+    signs = np.where(hashes & np.uint64(1 << 31), -1.0, 1.0)
+    vector = np.bincount((hashes % np.uint64(dim)).astype(np.int64), weights=signs, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _VectorIndex:
+    """Unit vectors, signatures and answers for one embedding space and backend."""
+
+    def __init__(self, np, dim, capacity, vectors=None, created=None, used=None, responses=None, signatures=None):
+        self.np = np
+        self.capacity = capacity
+        self.count = 0 if vectors is None else len(vectors)
+        size = max(256, self.count)
+        self.vectors = np.zeros((size, dim), dtype=np.float32)
+        self.created = np.zeros(size)
+        self.used = np.zeros(size)
+        self.signatures = np.zeros(size, dtype=np.int64)
+        self.responses = list(responses or [])
+        if self.count:
+            self.vectors[:self.count] = vectors
+            self.created[:self.count] = created
+            self.used[:self.count] = used
+            # Entries saved before signatures existed can never match one
+            self.signatures[:self.count] = signatures if signatures is not None else np.iinfo(np.int64).min
+
+    def search(self, vector, signature):
+        if not self.count:
+            return None, 0.0
+        scores = self.vectors[:self.count] @ vector
+        # "error 404" and "error 500" embed almost identically; a different signature is a different question
+        scores[self.signatures[:self.count] != signature] = -1.0
+        best = int(self.np.argmax(scores))
+        return best, float(scores[best])
+
+    def add(self, vector, signature, response, now):
+        if self.count >= self.capacity:
+            self.remove(int(self.np.argmin(self.used[:self.count])))
+        if self.count == len(self.vectors):
+            size = min(self.capacity, len(self.vectors) * 2)
+            self.vectors = self.np.resize(self.vectors, (size, self.vectors.shape[1]))
+            self.created = self.np.resize(self.created, size)
+            self.used = self.np.resize(self.used, size)
+            self.signatures = self.np.resize(self.signatures, size)
+        self.vectors[self.count] = vector
+        self.signatures[self.count] = signature
+        self.created[self.count] = self.used[self.count] = now
+        self.responses.append(response)
+        self.count += 1
+
+    def remove(self, index):
+        # Move the last entry into the gap so the live rows stay contiguous
+        last = self.count - 1
+        self.vectors[index] = self.vectors[last]
+        self.created[index] = self.created[last]
+        self.used[index] = self.used[last]
+        self.signatures[index] = self.signatures[last]
+        self.responses[index] = self.responses[last]
+        self.responses.pop()
+        self.count = last
+
+
+class SemanticCache:
+    """Answers for inputs that nearly match ones already answered.
+
+    Inputs are embedded with the local Ollama ``EMBED_MODEL``, or with
+    ``hashed_embedding`` when that model is unavailable or slow. Each
+    embedding space and backend has its own NumPy index, searched with one
+    matrix-vector product. With model embeddings the stored answer is reused
+    when the best cosine similarity reaches ``threshold`` and both texts have
+    the same meaningful numbers (``number_signature``). Trigram vectors cannot
+    tell "x > y" from "x < y" or "safe" from "unsafe" at any usable
+    threshold, so hashed ones are only reused for a text that is the same
+    once case, whitespace and noise numbers are folded (``folded_signature``).
+    An index holds at most ``max_entries``
+    (least recently used evicted first), entries expire after ``ttl_seconds``,
+    and everything is saved to ``path`` every ``save_every`` additions and on
+    ``close()``. NumPy is imported on first use.
+    """
+
+    def __init__(self, path=DATA_DIR / "semantic_cache.npz", threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=20000, ttl_seconds=7 * 24 * 60 * 60, use_ollama=True,
+                 embed_timeout=0.5, embed_retry_seconds=300, max_embed_chars=8000, save_every=50):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.use_ollama = use_ollama
+        self.embed_timeout = embed_timeout
+        self.embed_retry_seconds = embed_retry_seconds
+        self.max_embed_chars = max_embed_chars
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._indexes = None
+        self._unsaved = 0
+        self._ollama_failed_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namespace(backend, model, quick=False):
+        return f"{backend}:{model}{':quick' if quick else ''}"
+
+    async def embed(self, engine, text):
+        """Return (space, unit vector, signature) for ``text``; runs on the engine loop."""
+        import numpy as np
+        retry_ok = (self._ollama_failed_at is None
+                    or time.monotonic() - self._ollama_failed_at > self.embed_retry_seconds)
+        if self.use_ollama and retry_ok and len(text) <= self.max_embed_chars:
+            # Noted before the request: Ollama may finish loading the model after a timeout gives up on it
+            engine.note_model(EMBED_MODEL, embedding=True)
+            try:
+                result = await asyncio.wait_for(
+                    engine.ollama_client().embeddings(model=EMBED_MODEL, prompt=text,
+                                                      keep_alive=engine.ollama_keep_alive),
+                    self.embed_timeout)
+                vector = np.asarray(result['embedding'], dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                if norm:
+                    self._ollama_failed_at = None
+                    return EMBED_MODEL, vector / norm, number_signature(text)
+            except Exception as e:
+                log.info("Ollama embedding unavailable, using hashed n-grams: %s", e or type(e).__name__)
+                self._ollama_failed_at = time.monotonic()
+        return "hashed", hashed_embedding(text), folded_signature(text)
+
+    def search(self, embedding, namespace):
+        """Return the stored answer nearest to ``embedding`` if it is close enough."""
+        space, vector, signature = embedding
+        start = time.perf_counter()
+        with self._lock:
+            index = self._index(space, namespace, len(vector), create=False)
+            best, score = index.search(vector, signature) if index is not None else (None, 0.0)
+            response = None
+            if best is not None and score >= self.threshold:
+                now = time.time()
+                if now - index.created[best] < self.ttl_seconds:
+                    index.used[best] = now
+                    response = index.responses[best]
+                else:
+                    index.remove(best)
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.observe("semantic_cache.search", time.perf_counter() - start)
+        if response is not None:
+            log.info("Semantic cache hit (similarity %.3f)", score)
+        return response
+
+    def add(self, embedding, namespace, response):
+        space, vector, signature = embedding
+        with self._lock:
+            self._index(space, namespace, len(vector)).add(vector, signature, response, time.time())
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+
+    def _index(self, space, namespace, dim, create=True):
+        if self._indexes is None:
+            self._indexes = self._load()
+        index = self._indexes.get((space, namespace))
+        if index is None and create:
+            import numpy as np
+            index = self._indexes[(space, namespace)] = _VectorIndex(np, dim, self.max_entries)
+        return index
+
+    def _load(self):
+        import numpy as np
+        indexes = {}
+        if not self.path.exists():
+            return indexes
+        try:
+            with np.load(self.path) as data:
+                meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+                for i, entry in enumerate(meta):
+                    vectors = data[f'vectors_{i}']
+                    times = data[f'times_{i}']
+                    key = f'signatures_{i}'
+                    signatures = data[key][-self.max_entries:] if key in data.files else None
+                    indexes[(entry['space'], entry['namespace'])] = _VectorIndex(
+                        np, vectors.shape[1], self.max_entries, vectors[-self.max_entries:],
+                        times[0][-self.max_entries:], times[1][-self.max_entries:],
+                        entry['responses'][-self.max_entries:], signatures)
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Semantic cache could not be loaded, starting empty: %s", e)
+            return {}
+        return indexes
+
+    def _save(self):
+        if not self._indexes:
+            return
+        import numpy as np
+        arrays, meta = {}, []
+        for i, ((space, namespace), index) in enumerate(self._indexes.items()):
+            arrays[f'vectors_{i}'] = index.vectors[:index.count]
+            arrays[f'times_{i}'] = np.stack([index.created[:index.count], index.used[:index.count]])
+            arrays[f'signatures_{i}'] = index.signatures[:index.count]
+            meta.append({'space': space, 'namespace': namespace, 'responses': index.responses})
+        arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = self.path.with_name(self.path.name + ".tmp")
+            with open(temporary, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temporary, self.path)
+            self._unsaved = 0
+        except OSError as e:
+            log.warning("Semantic cache save failed: %s", e)
+
+    def stats(self):
+        with self._lock:
+            entries = {f"{space}/{namespace}": index.count
+                       for (space, namespace), index in (self._indexes or {}).items()}
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def release(self):
+        """Save and drop the in-memory indexes; the next lookup loads them again."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+            # Keep entries that could not be written rather than lose them
+            if not self._unsaved:
+                self._indexes = None
+
+    def close(self):
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+
+class RequestQueue:
+    """Copied texts that could not be answered because no backend was reachable.
+
+    Kept in SQLite so they survive a restart, and keyed on the normalized
+    text, so copying the same thing again while offline queues it once.
+    Answers stay in the table to be browsed later; past ``max_entries``
+    finished entries (and past ``max_pending`` waiting ones) the oldest are
+    dropped. A request that reaches a backend but still fails is given up
+    after ``max_attempts``. The number waiting is kept in the
+    ``offline_queue.depth`` gauge.
+    """
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path=DATA_DIR / "request_queue.sqlite3", max_entries=200, max_pending=500, max_attempts=3):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.queued = 0
+        self.duplicates = 0
+        self.answered = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS requests (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    quick INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    queued REAL NOT NULL,
+                    answered REAL,
+                    backend TEXT,
+                    response TEXT,
+                    error TEXT
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS requests_status ON requests (status, queued)")
+            self._db.commit()
+            with self._lock:
+                self._publish_depth()
+        except (OSError, sqlite3.Error) as e:
+            log.warning("Offline queue unavailable: %s", e)
+            self._db = None
+
+    @staticmethod
+    def make_key(text, quick=False):
+        normalized = " ".join(text.split())
+        return hashlib.sha256(json.dumps([normalized, bool(quick)]).encode("utf-8")).hexdigest()
+
+    def add(self, text, quick=False):
+        """Queue ``text``; returns True if it is waiting in the queue (now or already)."""
+        key = self.make_key(text, quick)
+        with self._lock:
+            if self._db is None:
+                return False
+            try:
+                row = self._db.execute("SELECT status FROM requests WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[0] == self.PENDING:
+                    self.duplicates += 1
+                    metrics.incr("offline_queue.duplicate")
+                    return True
+                self._db.execute(
+                    "INSERT OR REPLACE INTO requests (key, text, quick, status, queued) VALUES (?, ?, ?, ?, ?)",
+                    (key, text, int(quick), self.PENDING, time.time())
+                )
+                self._prune(self.PENDING, self.max_pending)
+                self._db.commit()
+            except sqlite3.Error as e:
+                log.warning("Offline queue write failed: %s", e)
+                return False
+            self.queued += 1
+            metrics.incr("offline_queue.queued")
+            self._publish_depth()
+        return True
+
+    def pending(self, limit):
+        """The ``limit`` longest-waiting requests as (key, text, quick)."""
+        with self._lock:
+            if self._db is None:
+                return []
+            try:
+                rows = self._db.execute(
+                    "SELECT key, text, quick FROM requests WHERE status = ? ORDER BY queued LIMIT ?",
+                    (self.PENDING, limit)
+                ).fetchall()
+            except sqlite3.Error as e:
+                log.warning("Offline queue read failed: %s", e)
+                return []
+        return [(key, text, bool(quick)) for key, text, quick in rows]
+
+    def complete(self, key, backend, response):
+        with self._lock:
+            self._update(
+                "UPDATE requests SET status = ?, answered = ?, backend = ?, response = ?, error = NULL WHERE key = ?",
+                (self.DONE, time.time(), backend, response, key)
+            )
+            self.answered += 1
+
+    def fail(self, key, error):
+        """Count a failed attempt; the request is given up after ``max_attempts``."""
+        with self._lock:
+            self._update(
+                "UPDATE requests SET attempts = attempts + 1, error = ?,"
+                " status = CASE WHEN attempts + 1 >= ? THEN ? ELSE status END WHERE key = ?",
+                (error, self.max_attempts, self.FAILED, key)
+            )
+            self.failed += 1
+
+    def clear_answers(self):
+        with self._lock:
+            self._update("DELETE FROM requests WHERE status = ?", (self.DONE,))
+
+    def results(self, limit=10):
+        """The most recent answers as (key, text, quick, response, answered_at)."""
+        with self._lock:
+            if self._db is None:
+                return []
+            try:
+                rows = self._db.execute(
+                    "SELECT key, text, quick, response, answered FROM requests WHERE status = ?"
+                    " ORDER BY answered DESC LIMIT ?",
+                    (self.DONE, limit)
+                ).fetchall()
+            except sqlite3.Error as e:
+                log.warning("Offline queue read failed: %s", e)
+                return []
+        return [(key, text, bool(quick), response, answered) for key, text, quick, response, answered in rows]
+
+    def depth(self):
+        with self._lock:
+            return self._count(self.PENDING)
+
+    def _update(self, statement, parameters):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(statement, parameters)
+            self._prune(self.DONE, self.max_entries)
+            self._prune(self.FAILED, self.max_entries)
+            self._db.commit()
+        except sqlite3.Error as e:
+            log.warning("Offline queue write failed: %s", e)
+        self._publish_depth()
+
+    def _prune(self, status, keep):
+        self._db.execute("""
+            DELETE FROM requests WHERE key IN (
+                SELECT key FROM requests WHERE status = ? ORDER BY COALESCE(answered, queued) DESC LIMIT -1 OFFSET ?
+            )
+        """, (status, keep))
+
+    def _count(self, status):
+        if self._db is None:
+            return 0
+        try:
+            return self._db.execute("SELECT COUNT(*) FROM requests WHERE status = ?", (status,)).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def _publish_depth(self):
+        metrics.set("offline_queue.depth", self._count(self.PENDING))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._count(self.PENDING),
+                'answered_waiting': self._count(self.DONE),
+                'queued': self.queued,
+                'duplicates': self.duplicates,
+                'answered': self.answered,
+                'failed_attempts': self.failed,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def is_network_error(error):
+    """Return True if ``error`` means the backend could not be reached at all."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # Matched by name so the HTTP and gRPC client libraries need not be imported here
+    return type(error).__name__ in ("ConnectionError", "ConnectError", "ConnectTimeout", "ReadTimeout",
+                                    "Timeout", "ServiceUnavailable", "DeadlineExceeded", "RetryError")
+
+
+class ConnectivityMonitor:
+    """Keeps a cached online/offline state for the remote backend.
+
+    A daemon thread probes ``url`` every ``interval`` seconds while online and
+    with exponential backoff while offline, so reading ``online`` never does
+    network I/O. Real request outcomes reported through ``report_failure`` and
+    ``report_success`` update the state immediately.
+    """
+
+    def __init__(self, url=GEMINI_HEALTH_URL, interval=60, min_backoff=2, max_backoff=300, timeout=3):
+        self.url = url
+        self.interval = interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.online = False
+        self._stopped = False
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ConnectivityMonitor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def report_failure(self):
+        log.info("Backend call failed, marking remote backend offline")
+        self._set_online(False)
+        self._wake.set()  # Restart the backoff schedule from the shortest delay
+
+    def report_success(self):
+        self._set_online(True)
+
+    def _set_online(self, online):
+        if online != self.online:
+            log.info("Connectivity changed: %s", 'online' if online else 'offline')
+        self.online = online
+
+    def _probe(self):
+        import requests
+        try:
+            requests.head(self.url, timeout=self.timeout)
+            return True
+        except requests.RequestException:
+            return False
+
+    def _run(self):
+        backoff = self.min_backoff
+        delay = 0
+        while True:
+            if self._wake.wait(delay):
+                self._wake.clear()
+                if self._stopped:
+                    return
+                backoff = self.min_backoff
+                delay = backoff
+                continue
+
+            online = self._probe()
+            if self._stopped:
+                return
+            self._set_online(online)
+            if online:
+                backoff = self.min_backoff
+                delay = self.interval
+            else:
+                delay = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+
+
+class Conversation:
+    """Role-tagged message history for one copied text and its follow-ups.
+
+    The first exchange (the copied text and its answer) is never trimmed, so
+    the start of the prompt stays byte-identical across turns and Ollama can
+    reuse its KV cache. Once the history exceeds ``token_budget``, the oldest
+    follow-up turns are dropped in one batch down to ``trim_to`` of the budget;
+    the kept prefix then stays stable for several turns instead of shifting on
+    every one.
+
+    Text too large to prompt with directly is replaced by ``digest``, notes on
+    its parts written by the first request, once that request has them.
+    A ``quick`` conversation asks for a short first answer.
+    """
+
+    def __init__(self, text, token_budget=CONTEXT_TOKEN_BUDGET, trim_to=0.6, quick=False):
+        self.text = text
+        self.quick = quick
+        self.digest = None
+        self.token_budget = token_budget
+        self.trim_to = trim_to
+        self.turns = []
+        self.trimmed_turns = 0
+
+    @staticmethod
+    def estimate_tokens(content):
+        return len(content) // CHARS_PER_TOKEN + 4
+
+    def add_user(self, content):
+        self.turns.append({'role': 'user', 'content': content})
+
+    def add_assistant(self, content):
+        self.turns.append({'role': 'assistant', 'content': content})
+
+    def history(self):
+        """Return the turns that follow the copied text, trimmed to the token budget."""
+        total = self.estimate_tokens(self.digest or self.text) + sum(self.estimate_tokens(t['content']) for t in self.turns)
+        if total > self.token_budget:
+            target = self.token_budget * self.trim_to
+            # Keep the first answer and the newest message; drop the oldest follow-up
+            # question/answer pairs in between
+            while total > target and len(self.turns) > 3:
+                for _ in range(2):
+                    total -= self.estimate_tokens(self.turns.pop(1)['content'])
+                    self.trimmed_turns += 1
+            log.debug("Trimmed conversation to ~%d tokens (%d turns dropped so far)", total, self.trimmed_turns)
+        return list(self.turns)
+
+    def messages(self, prompt_template, history=None):
+        if self.digest is not None:
+            first = {'role': 'user', 'content': DIGEST_PROMPT_TEMPLATE.format(notes=self.digest)}
+        else:
+            first = {'role': 'user', 'content': prompt_template.format(text=self.text)}
+        return [first] + (self.history() if history is None else history)
+
+
+class BackendStats:
+    """Rolling first-token latency, generation speed and error rate of one backend or model tier."""
+
+    def __init__(self, first_token_prior, tokens_per_second_prior, window=50):
+        self.first_token_prior = first_token_prior
+        self.tokens_per_second_prior = tokens_per_second_prior
+        self.first_token = deque(maxlen=window)
+        self.tokens_per_second = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def record_success(self, first_token, tokens_per_second):
+        self.first_token.append(first_token)
+        self.tokens_per_second.append(tokens_per_second)
+        self.outcomes.append(True)
+
+    def record_error(self):
+        self.outcomes.append(False)
+
+    def record_lost(self, elapsed):
+        # A hedged loser never got to its first token, so its elapsed time is a lower bound
+        self.first_token.append(elapsed)
+
+    @property
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def median_first_token(self):
+        return statistics.median(self.first_token) if self.first_token else self.first_token_prior
+
+    def p90_first_token(self):
+        if not self.first_token:
+            return self.first_token_prior * 2
+        ordered = sorted(self.first_token)
+        return ordered[int(len(ordered) * 0.9)]
+
+    def median_tokens_per_second(self):
+        return statistics.median(self.tokens_per_second) if self.tokens_per_second else self.tokens_per_second_prior
+
+    def expected_latency(self, expected_tokens, error_penalty):
+        return (self.median_first_token()
+                + expected_tokens / self.median_tokens_per_second()
+                + self.error_rate * error_penalty)
+
+
+class BackendRouter:
+    """Decides when a request still waiting for its first token is hedged.
+
+    The order backends are tried in comes from TierPolicy, which measures the
+    model tier each one answers with. With hedging on, a request that has no
+    token from its first backend after ``hedge_after`` seconds (or, by
+    default, the p90 first-token latency of that backend's tier) is also sent
+    to the next.
+    """
+
+    def __init__(self, hedge=True, hedge_after=None, min_hedge_after=0.75):
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.min_hedge_after = min_hedge_after
+        self.hedges_started = 0
+        self.hedges_won = 0
+
+    def hedge_deadline(self, stats):
+        """Seconds to wait for a first token, given the BackendStats of the tier being waited on."""
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        return max(self.min_hedge_after, stats.p90_first_token())
+
+    def snapshot(self):
+        return {'hedges_started': self.hedges_started, 'hedges_won': self.hedges_won}
+
+
+def content_type(text, sample_chars=4000):
+    """'code', 'structured' (JSON, CSV, logs) or 'prose', judged from the start of ``text``."""
+    sample = text[:sample_chars]
+    lines = [line for line in sample.splitlines() if line.strip()]
+    if len(lines) >= 3 and sum(1 for line in lines if CODE_LINE_PATTERN.search(line)) >= 0.3 * len(lines):
+        return 'code'
+    if is_structured(sample):
+        return 'structured'
+    return 'prose'
+
+
+class TierPolicy:
+    """Picks the model tier each backend answers a request with, and the order to try them in.
+
+    Tiers run from fastest to strongest. Quick answers and short prose need
+    only the first tier; code, structured data and long texts the strongest;
+    everything else the one after the first. Each tier keeps BackendStats and
+    is ranked by expected latency for its token cap:
+    those that fit the request's latency budget first, then those strong
+    enough for it, then the fastest. No budget means none is missed, and an
+    unmet budget only reorders the tiers, it never refuses a request. A tier
+    whose model Ollama does not have (per ``set_installed``, or a 404 during
+    a request, which then moves on to ``fallback``) is passed over for
+    ``missing_retry_seconds`` while its backend has another.
+    """
+
+    def __init__(self, tiers=None, priors=None, short_chars=SHORT_TEXT_CHARS, long_chars=LONG_TEXT_CHARS,
+                 expected_tokens=250, error_penalty=10.0, missing_retry_seconds=600):
+        self.tiers = dict(tiers or MODEL_TIERS)
+        priors = {**TIER_PRIORS, **(priors or {})}
+        self.levels = {name: level for level, name in enumerate(self.tiers)}
+        self.stats = {name: BackendStats(*priors.get(name, BACKEND_PRIORS[backend]))
+                      for name, (backend, _, _) in self.tiers.items()}
+        self.short_chars = short_chars
+        self.long_chars = long_chars
+        self.expected_tokens = expected_tokens
+        self.error_penalty = error_penalty
+        self.missing_retry_seconds = missing_retry_seconds
+        self.chosen = dict.fromkeys(self.tiers, 0)
+        self._missing = {}
+
+    @classmethod
+    def from_file(cls, path):
+        """Load tiers from a JSON file; defaults are used if it is missing or invalid.
+
+            {"tiers": {"small": ["ollama", "qwen2.5:0.5b", 200], "medium": ["ollama", "llama3.1:8b", 768]}}
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+            configured_tiers = dict(config.get('tiers') or {})
+            short_chars = int(config.get('short_chars', SHORT_TEXT_CHARS))
+            long_chars = int(config.get('long_chars', LONG_TEXT_CHARS))
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            log.warning("Ignoring model tier config %s: %s", path, e)
+            return cls()
+        tiers = {}
+        for name, tier in configured_tiers.items():
+            try:
+                backend, model, max_tokens = tier
+                max_tokens = int(max_tokens)
+            except (TypeError, ValueError):
+                backend = None
+            if backend not in BACKEND_PRIORS:
+                log.warning("Ignoring model tier %s: %s", name, tier)
+                continue
+            tiers[name] = (backend, model, max_tokens)
+        return cls(tiers or None, short_chars=short_chars, long_chars=long_chars)
+
+    def required_level(self, text, quick=False):
+        strongest = len(self.tiers) - 1
+        if quick:
+            return 0
+        if len(text) >= self.long_chars or content_type(text) != 'prose':
+            return strongest
+        return 0 if len(text) <= self.short_chars else min(1, strongest)
+
+    def max_tokens(self, tier, quick=False):
+        cap = self.tiers[tier][2]
+        return min(cap, QUICK_ANSWER_TOKENS) if quick else cap
+
+    def expected_latency(self, tier, quick=False):
+        tokens = min(self.max_tokens(tier, quick), self.expected_tokens)
+        return self.stats[tier].expected_latency(tokens, self.error_penalty)
+
+    def plan(self, text, backends, quick=False, budget=None):
+        """Return [(backend, tier)] for ``backends`` in the order to try them, one tier each."""
+        need = self.required_level(text, quick)
+        now = time.monotonic()
+        options = [name for name, (backend, _, _) in self.tiers.items() if backend in backends]
+        available = [name for name in options if self._missing.get(name, 0) <= now]
+        # A backend whose every tier was reported missing still gets tried; the model may be there by now
+        covered = {self.tiers[name][0] for name in available}
+        options = available + [name for name in options if self.tiers[name][0] not in covered]
+
+        def rank(name):
+            expected = self.expected_latency(name, quick)
+            return (budget is not None and expected > budget, max(0, need - self.levels[name]),
+                    expected, backends.index(self.tiers[name][0]))
+
+        plan = []
+        for name in sorted(options, key=rank):
+            backend = self.tiers[name][0]
+            if backend not in dict(plan):
+                plan.append((backend, name))
+        return plan
+
+    def fallback(self, tier):
+        """Another available tier of ``tier``'s backend, stronger ones first, or None."""
+        backend, level, now = self.tiers[tier][0], self.levels[tier], time.monotonic()
+        others = [name for name, (other, _, _) in self.tiers.items()
+                  if other == backend and name != tier and self._missing.get(name, 0) <= now]
+        # A slower answer beats none, so the next stronger tier is tried before any weaker one
+        others.sort(key=lambda name: (self.levels[name] < level, abs(self.levels[name] - level)))
+        return others[0] if others else None
+
+    @staticmethod
+    def is_missing_model(error):
+        # Ollama answers 404 for a model that has not been pulled
+        return getattr(error, 'status_code', None) == 404
+
+    def set_installed(self, models):
+        """Pass over the Ollama tiers whose model is not among ``models`` (names from /api/tags)."""
+        installed = {model if ':' in model else f"{model}:latest" for model in models}
+        for name, (backend, model, _) in self.tiers.items():
+            if backend != 'ollama':
+                continue
+            if (model if ':' in model else f"{model}:latest") in installed:
+                self._missing.pop(name, None)
+            else:
+                log.warning("%s is not pulled; not using the %s tier", model, name)
+                self._missing[name] = time.monotonic() + self.missing_retry_seconds
+
+    def local_models(self):
+        """Models of the Ollama tiers requests can be routed to, fastest tier first."""
+        now = time.monotonic()
+        models = [model for name, (backend, model, _) in self.tiers.items()
+                  if backend == 'ollama' and self._missing.get(name, 0) <= now]
+        return list(dict.fromkeys(models))
+
+    def record_chosen(self, tier):
+        self.chosen[tier] += 1
+        metrics.incr(f"tier.{tier}.chosen")
+
+    def record_success(self, tier, first_token, tokens_per_second, total):
+        self.stats[tier].record_success(first_token, tokens_per_second)
+        metrics.observe(f"tier.{tier}.first_token", first_token)
+        metrics.observe(f"tier.{tier}.total", total)
+
+    def record_error(self, tier, error=None):
+        self.stats[tier].record_error()
+        if self.is_missing_model(error):
+            log.warning("%s is not available; not using the %s tier for %d s",
+                        self.tiers[tier][1], tier, self.missing_retry_seconds)
+            self._missing[tier] = time.monotonic() + self.missing_retry_seconds
+
+    def record_lost(self, tier, elapsed):
+        self.stats[tier].record_lost(elapsed)
+
+    def snapshot(self):
+        return {
+            name: {
+                'model': model,
+                'max_tokens': max_tokens,
+                'chosen': self.chosen[name],
+                'first_token_p50_ms': round(self.stats[name].median_first_token() * 1000),
+                'tokens_per_second': round(self.stats[name].median_tokens_per_second(), 1),
+                'error_rate': round(self.stats[name].error_rate, 2),
+                'samples': len(self.stats[name].first_token),
+            }
+            for name, (backend, model, max_tokens) in self.tiers.items()
+        }
+
+
+class _Slot:
+    """One request's claim on a backend slot, waiting or held."""
+
+    def __init__(self, backend, request):
+        self.backend = backend
+        self.request = request
+        self.queued_at = time.perf_counter()
+        self.waiter = None
+        self.preempting = False
+
+    @property
+    def rank(self):
+        # Read on every decision: a speculation that is copied becomes a copy
+        return PRIORITY_CLASSES.index(self.request.priority)
+
+
+class PriorityScheduler:
+    """Shares each backend's ``limits[backend]`` stream slots between request classes.
+
+    A request holds a slot for each stream it runs (``async with
+    scheduler.slot(backend, request)``). When a backend is full, a waiting
+    request preempts the lowest-class, newest holder of a lower class than its
+    own, and the freed slot goes to the most urgent class waiting. Requests of
+    the same or a higher class are never interrupted. Within a class the
+    request owners take turns, so one source cannot starve another. Time spent
+    waiting feeds the ``<name>.wait.<class>`` histogram.
+
+    ``request`` is anything with ``priority`` (one of PRIORITY_CLASSES) and
+    ``owner`` attributes and a ``preempt()`` method that makes it give up its
+    slots; TextProcessor is one. Must be used from a single event loop.
+    """
+
+    def __init__(self, limits=None, window=200, name="scheduler"):
+        self.limits = {**BACKEND_CONCURRENCY, **(limits or {})}
+        self.name = name
+        self.holders = {}
+        self._queues = {}
+        self.admitted = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self.preempted = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self.waits = {name: deque(maxlen=window) for name in PRIORITY_CLASSES}
+
+    @classmethod
+    def from_file(cls, path):
+        """Load per-backend limits from a JSON file ({"limits": {"ollama": 2}}); defaults if missing or invalid."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+            limits = {backend: int(limit) for backend, limit in (config.get('limits') or {}).items()}
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            log.warning("Ignoring scheduler config %s: %s", path, e)
+            return cls()
+        return cls({backend: limit for backend, limit in limits.items() if limit > 0})
+
+    @asynccontextmanager
+    async def slot(self, backend, request):
+        """Hold one of ``backend``'s slots for the body of the ``async with``."""
+        entry = _Slot(backend, request)
+        await self._acquire(entry)
+        try:
+            yield
+        finally:
+            self._release(entry)
+
+    async def _acquire(self, entry):
+        holders = self.holders.setdefault(entry.backend, [])
+        if len(holders) < self.limits.get(entry.backend, 1):
+            self._admit(entry)
+            return
+        entry.waiter = asyncio.get_running_loop().create_future()
+        self._enqueue(entry)
+        self._preempt_for(entry)
+        try:
+            await entry.waiter
+        except asyncio.CancelledError:
+            if entry.waiter.done() and not entry.waiter.cancelled():
+                # The slot was granted just as the request went away; pass it on
+                self._release(entry)
+            else:
+                self._discard(entry)
+            raise
+
+    def _enqueue(self, entry):
+        classes = self._queues.setdefault(entry.backend, {})
+        owners = classes.setdefault(entry.request.priority, OrderedDict())
+        owners.setdefault(entry.request.owner, deque()).append(entry)
+
+    def _admit(self, entry):
+        self.holders[entry.backend].append(entry)
+        priority = entry.request.priority
+        waited = time.perf_counter() - entry.queued_at
+        self.admitted[priority] += 1
+        self.waits[priority].append(waited)
+        metrics.observe(f"{self.name}.wait.{priority}", waited)
+
+    def _preempt_for(self, entry):
+        victims = [holder for holder in self.holders[entry.backend]
+                   if holder.rank > entry.rank and not holder.preempting]
+        if not victims:
+            return
+        # The least urgent goes first, and of those the one that has had its slot the shortest
+        victim = max(reversed(victims), key=lambda holder: holder.rank)
+        victim.preempting = True
+        self.preempted[victim.request.priority] += 1
+        metrics.incr(f"{self.name}.preempted.{victim.request.priority}")
+        log.info("Preempting a %s request on %s for a %s one",
+                 victim.request.priority, entry.backend, entry.request.priority)
+        victim.request.preempt()
+
+    def _release(self, entry):
+        holders = self.holders[entry.backend]
+        holders.remove(entry)
+        while len(holders) < self.limits.get(entry.backend, 1):
+            waiting = self._next(entry.backend)
+            if waiting is None:
+                break
+            self._admit(waiting)
+            waiting.waiter.set_result(None)
+
+    def _next(self, backend):
+        classes = self._queues.get(backend, {})
+        for priority in PRIORITY_CLASSES:
+            owners = classes.get(priority)
+            if not owners:
+                continue
+            owner, entries = next(iter(owners.items()))
+            entry = entries.popleft()
+            if entries:
+                owners.move_to_end(owner)
+            else:
+                del owners[owner]
+            return entry
+        return None
+
+    def _discard(self, entry):
+        owners = self._queues.get(entry.backend, {}).get(entry.request.priority, {})
+        entries = owners.get(entry.request.owner)
+        if entries is not None and entry in entries:
+            entries.remove(entry)
+            if not entries:
+                del owners[entry.request.owner]
+
+    def requeue(self, request, previous):
+        """Move ``request``'s waiting slots from the ``previous`` class queue to its current one."""
+        for backend, classes in self._queues.items():
+            entries = classes.get(previous, {}).get(request.owner, ())
+            for entry in [entry for entry in entries if entry.request is request]:
+                entries.remove(entry)
+                self._enqueue(entry)
+                self._preempt_for(entry)
+            if not entries and request.owner in classes.get(previous, {}):
+                del classes[previous][request.owner]
+
+    def stats(self):
+        def percentile(values, fraction):
+            return round(values[int(len(values) * fraction)] * 1000, 1) if values else None
+
+        waits = {}
+        for priority, samples in self.waits.items():
+            ordered = sorted(samples)
+            waits[priority] = {'p50_ms': percentile(ordered, 0.5), 'p90_ms': percentile(ordered, 0.9)}
+        return {
+            'limits': dict(self.limits),
+            'active': {backend: len(holders) for backend, holders in self.holders.items()},
+            'queued': {priority: sum(len(entries) for classes in self._queues.values()
+                                     for entries in classes.get(priority, {}).values())
+                       for priority in PRIORITY_CLASSES},
+            'admitted': dict(self.admitted),
+            'preempted': dict(self.preempted),
+            'wait': waits,
+        }
+
+
+class BackendEngine:
+    """Single long-lived asyncio loop that runs every backend stream.
+
+    The Ollama ``AsyncClient`` and the Gemini chat models are created once and
+    reused, so their HTTP and gRPC connections stay pooled between requests.
+    ``warm_tiers`` loads the models of the tiers requests can be routed to.
+    ``release`` unloads every Ollama model the engine has used and drops both
+    clients while the app is idle; they are created again on next use. Any number of streams can run
+    concurrently as tasks on the loop.
+    ``ollama_host`` and ``gemini_endpoint`` override where requests go, e.g.
+    to point the engine at the mock servers in ``benchmarks/``.
+    """
+
+    def __init__(self, keepalive_seconds=HTTP_KEEPALIVE_SECONDS, ollama_keep_alive=OLLAMA_KEEP_ALIVE,
+                 ollama_host=None, gemini_endpoint=None):
+        self.keepalive_seconds = keepalive_seconds
+        self.ollama_keep_alive = ollama_keep_alive
+        self.ollama_host = ollama_host
+        self.gemini_endpoint = gemini_endpoint
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="BackendEngine", daemon=True)
+        self._ollama_client = None
+        self._gemini_models = {}
+        # Ollama models this engine has loaded, mapped to whether they are embedding models
+        self.ollama_models = {}
+        # Warming and unloading the model must reach Ollama in the order they were asked for
+        self._model_lock = asyncio.Lock()
+        self.router = BackendRouter()
+        self.tiers = TierPolicy()
+        self.scheduler = PriorityScheduler()
+        self.first_token_latencies = {}
+        self.warmup_durations = []
+        self.request_load_durations = []
+
+    def start(self):
+        self._thread.start()
+
+    def record_first_token(self, backend, seconds):
+        metrics.observe(f"first_token.{backend}", seconds)
+        latencies = self.first_token_latencies.setdefault(backend, deque(maxlen=200))
+        latencies.append(seconds)
+
+    def first_token_stats(self):
+        stats = {}
+        for backend, latencies in self.first_token_latencies.items():
+            ordered = sorted(latencies)
+            stats[backend] = {
+                'count': len(ordered),
+                'p50_ms': round(ordered[len(ordered) // 2] * 1000),
+                'p90_ms': round(ordered[int(len(ordered) * 0.9)] * 1000),
+            }
+        return stats
+
+    def record_model_load(self, seconds):
+        metrics.observe("model_load", seconds)
+        self.request_load_durations.append(seconds)
+
+    def model_load_stats(self):
+        return {
+            'warmups_ms': [round(s * 1000) for s in self.warmup_durations],
+            'loads_during_requests_ms': [round(s * 1000) for s in self.request_load_durations],
+        }
+
+    def note_model(self, model, embedding=False):
+        self.ollama_models[model] = embedding
+
+    async def warm_tiers(self):
+        """Load the model of every Ollama tier that is pulled; returns the seconds it took."""
+        start = time.perf_counter()
+        await self.check_models()
+        for model in self.tiers.local_models():
+            await self.warm_model(model)
+        return time.perf_counter() - start
+
+    async def warm_model(self, model=OLLAMA_MODEL):
+        """Load ``model`` into Ollama without generating anything; returns the seconds it took."""
+        self.note_model(model)
+        async with self._model_lock:
+            client = self.ollama_client()
+            start = time.perf_counter()
+            # An empty prompt only loads the model and (re)starts its keep-alive window
+            await client.generate(model=model, prompt='', keep_alive=self.ollama_keep_alive)
+            elapsed = time.perf_counter() - start
+        self.warmup_durations.append(elapsed)
+        return elapsed
+
+    async def check_models(self):
+        """Tell the tier policy which models Ollama has; tiers without theirs are passed over."""
+        try:
+            response = await self.ollama_client().list()
+        except Exception as e:
+            log.info("Could not list Ollama models: %s", e or type(e).__name__)
+            return
+        self.tiers.set_installed(model['name'] for model in response.get('models', []))
+
+    async def release(self):
+        """Unload every Ollama model this engine has used and close the pooled backend clients."""
+        async with self._model_lock:
+            client = self.ollama_client()
+            self._ollama_client = None
+            # The gRPC channels close once the models are collected
+            self._gemini_models = {}
+            models, self.ollama_models = self.ollama_models, {}
+            try:
+                # keep_alive=0 evicts a model as soon as this empty request completes
+                for model, embedding in models.items():
+                    if embedding:
+                        await client.embeddings(model=model, prompt='', keep_alive=0)
+                    else:
+                        await client.generate(model=model, prompt='', keep_alive=0)
+            finally:
+                await client._client.aclose()  # the ollama client has no public close
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def call_soon(self, callback, *args):
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def submit(self, coro):
+        """Run ``coro`` on the engine loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def ollama_client(self):
+        if self._ollama_client is None:
+            import httpx
+            import ollama
+            limits = httpx.Limits(max_keepalive_connections=8, keepalive_expiry=self.keepalive_seconds)
+            self._ollama_client = ollama.AsyncClient(host=self.ollama_host, limits=limits)
+        return self._ollama_client
+
+    def gemini_model(self, model_name):
+        model = self._gemini_models.get(model_name)
+        if model is None:
+            log.info("Initializing Gemini model")
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            client_options = {'api_endpoint': self.gemini_endpoint} if self.gemini_endpoint else None
+            model = ChatGoogleGenerativeAI(model=model_name, client_options=client_options)
+            self._gemini_models[model_name] = model
+        return model
+
+    def stop(self, timeout=2):
+        if not self._thread.is_alive():
+            return
+        try:
+            self.submit(self._shutdown()).result(timeout)
+        except Exception as e:
+            log.warning("Backend engine shutdown: %s", e)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def split_text(text, chunk_size=MAP_CHUNK_CHARS, chunk_overlap=MAP_CHUNK_OVERLAP):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.split_text(text)
+
+
+class TextProcessor:
+    """One request, run as a task on the shared BackendEngine loop.
+
+    Output is delivered through the ``on_*`` hooks, which are called on the
+    engine thread; subclasses override them to forward it where it is needed.
+    Its stages are marked on ``trace``, which is started here if the caller
+    did not already open one when the triggering event arrived. With
+    ``hedge=False`` a second backend only starts if the first one fails.
+    Given a ``queue``, a copied text that no backend could be reached for is
+    saved there to be answered later and ``on_queued`` is called instead of
+    ``on_error``.
+    Each backend answers with the model tier the engine's TierPolicy picks
+    for the text and ``latency_budget`` (seconds for the whole answer).
+    Backend streams take slots from the engine's PriorityScheduler under
+    ``priority``; a more urgent request can preempt this one, which then
+    stops without calling ``on_result`` or ``on_error``. Within a class,
+    requests from different ``source``s (clipboard, follow-up, queue...) take
+    turns.
+    """
+    
+    def __init__(self, conversation, engine, use_gemini=False, cache=None, connectivity=None, trace=None,
+                 semantic_cache=None, hedge=True, queue=None, latency_budget=None, priority=COPY,
+                 source="request"):
+        self.conversation = conversation
+        self.text = conversation.text
+        # Snapshot the turns now; the GUI thread keeps appending to the conversation
+        self.history = conversation.history()
+        # Only the first answer of a quick conversation is kept short
+        self.quick = conversation.quick and not self.history
+        self.engine = engine
+        self.use_gemini = use_gemini
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.connectivity = connectivity
+        self.hedge = hedge
+        self.queue = queue
+        self.latency_budget = latency_budget
+        self.priority = priority
+        self.source = source
+        # Backend -> name of the tier it answers with, decided when the request runs
+        self.tiers = {}
+        self.running = True
+        self.trace = trace if trace is not None else tracer.start("request")
+        self.outcome = None
+        self.error = None
+        self.chunks = 0
+        self.requested_at = None
+        self.first_token_at = None
+        self.winner = None
+        self._backend_tasks = {}
+        self.cancel_requested_at = None
+        self.stopped_at = None
+        self._task = None
+        self._done = threading.Event()
+
+    def on_chunk(self, content):
+        pass
+
+    def on_result(self, response):
+        pass
+
+    def on_error(self, message):
+        pass
+
+    def on_progress(self, done, total):
+        pass
+
+    def on_queued(self):
+        pass
+
+    def on_finished(self):
+        pass
+
+    async def drain(self):
+        """Awaited after every streamed chunk; a consumer that falls behind holds the stream here."""
+
+    def start(self):
+        self.requested_at = time.perf_counter()
+        self.trace.mark("started")
+        self.engine.call_soon(self._spawn)
+
+    def _spawn(self):
+        self._task = asyncio.ensure_future(self.run())
+        self._task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self.stopped_at = time.perf_counter()
+        self.trace.finish(self.outcome or "cancelled", chunks=self.chunks)
+        self._done.set()
+        self.on_finished()
+    
+    def stop(self):
+        # Non-blocking: cancelling the task closes the HTTP response, so the backend stops generating
+        if self.running and not self.isFinished():
+            self.cancel_requested_at = time.perf_counter()
+        self.running = False
+        self.engine.call_soon(self._cancel)
+
+    def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    @property
+    def owner(self):
+        # Requests from the same source take turns with other sources in the scheduler
+        return self.source
+
+    def preempt(self):
+        self.outcome = "preempted"
+        self.stop()
+
+    def raise_priority(self, priority):
+        """Move this request to a more urgent class, e.g. once a speculation is shown."""
+        previous, self.priority = self.priority, priority
+        if PRIORITY_CLASSES.index(priority) < PRIORITY_CLASSES.index(previous):
+            self.engine.call_soon(self.engine.scheduler.requeue, self, previous)
+
+    def isFinished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout_ms):
+        return self._done.wait(timeout_ms / 1000)
+    
+    async def run(self):
+        try:
+            if not self.running:
+                return
+                
+            log.debug("Starting text processing task")
+            candidates = ["gemini", "ollama"] if self.use_gemini and self._is_online() else ["ollama"]
+            plan = self.engine.tiers.plan(self.text, candidates, self.quick, self.latency_budget)
+            self.tiers = dict(plan)
+            backends = [backend for backend, _ in plan]
+
+            # Only the first answer for a copied text is cacheable; follow-ups depend on the history
+            cacheable = self.cache is not None and not self.history
+            if cacheable:
+                for backend in backends:
+                    cached_response = await asyncio.to_thread(self.cache.get, self._cache_key(backend))
+                    if cached_response is not None:
+                        log.info("Cache hit for %s (%d hits / %d misses)", backend, self.cache.hits, self.cache.misses)
+                        self.trace.mark("cache_hit", backend=backend)
+                        self._answer_from_cache(cached_response)
+                        return
+
+            embedding = None
+            if self.semantic_cache is not None and not self.history:
+                embedding = await self.semantic_cache.embed(self.engine, self.text)
+                for backend in backends:
+                    cached_response = await asyncio.to_thread(
+                        self.semantic_cache.search, embedding, self.semantic_cache.namespace(backend, self._model(backend), self.quick))
+                    if cached_response is not None:
+                        self.trace.mark("semantic_hit", backend=backend)
+                        self._answer_from_cache(cached_response)
+                        return
+
+            if self.conversation.digest is None and len(self.text) > LARGE_INPUT_CHARS:
+                self.conversation.digest = await self._condense(backends)
+                self.trace.mark("reduce")
+
+            backend, response = await self._generate(backends)
+            
+            if response and self.running:
+                log.info("Processing completed successfully on %s", backend)
+                if cacheable:
+                    await asyncio.to_thread(self.cache.put, self._cache_key(backend), response)
+                if embedding is not None:
+                    await asyncio.to_thread(self.semantic_cache.add, embedding,
+                                            self.semantic_cache.namespace(backend, self._model(backend), self.quick), response)
+                self.outcome = "done"
+                self.on_result(response)
+            elif self.running:
+                self.outcome = "error"
+                self.on_error("No response received from AI model")
+        except Exception as e:
+            self.error = e
+            if self.running and await self._queue_unavailable(e):
+                return
+            if self.running:
+                log.error("Error in TextProcessor: %s", e)
+                self.outcome = "error"
+                self.on_error(f"Error processing text: {str(e)}")
+
+    async def _queue_unavailable(self, error):
+        # Only a copied text with nothing shown yet can be answered later on its own
+        if self.queue is None or self.history or self.chunks or not is_network_error(error):
+            return False
+        if not await asyncio.to_thread(self.queue.add, self.text, self.quick):
+            return False
+        log.info("No backend reachable, queued the request for later")
+        self.outcome = "queued"
+        self.on_queued()
+        return True
+
+    async def _condense(self, backends):
+        """Boil an oversized text down to notes on its parts that fit in one prompt."""
+        notes = self.text
+        # Notes on a very long text can themselves be too long; summarize those again
+        for _ in range(MAP_MAX_ROUNDS):
+            if len(notes) <= LARGE_INPUT_CHARS:
+                break
+            # Splitting (and the first import of the splitter) stays off the engine loop
+            parts = await asyncio.to_thread(split_text, notes)
+            log.info("Large input (%d chars): summarizing %d parts", len(notes), len(parts))
+            self.trace.mark("map", parts=len(parts))
+            notes = await self._summarize_parts(backends, parts)
+        return notes
+
+    async def _summarize_parts(self, backends, parts):
+        semaphore = asyncio.Semaphore(MAP_WORKERS)
+        done = 0
+
+        async def summarize(index, part):
+            nonlocal done
+            async with semaphore:
+                prompt = MAP_PROMPT_TEMPLATE.format(index=index, count=len(parts), text=part)
+                note = await self._complete(backends, prompt)
+            done += 1
+            if self.running:
+                self.on_progress(done, len(parts))
+            return f"Part {index}: {note.strip()}"
+
+        if self.running:
+            self.on_progress(0, len(parts))
+        tasks = [asyncio.ensure_future(summarize(index, part)) for index, part in enumerate(parts, start=1)]
+        try:
+            return "\n\n".join(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _complete(self, backends, prompt):
+        """Non-streamed answer to a single ``prompt``, trying ``backends`` in order."""
+        error = None
+        for backend in backends:
+            try:
+                async with self.engine.scheduler.slot(backend, self):
+                    if backend == "gemini":
+                        from langchain_core.messages import HumanMessage
+                        model = self.engine.gemini_model(self._model(backend))
+                        reply = await model.ainvoke([HumanMessage(content=prompt)])
+                        return reply.content
+                    self.engine.note_model(self._model(backend))
+                    response = await self.engine.ollama_client().chat(
+                        model=self._model(backend),
+                        messages=[{'role': 'user', 'content': prompt}],
+                        keep_alive=self.engine.ollama_keep_alive,
+                        options={'num_predict': MAP_NOTE_TOKENS}
+                    )
+                    return response['message']['content']
+            except Exception as e:
+                log.warning("%s failed on a part: %s", backend, e)
+                self.engine.tiers.record_error(self.tiers[backend], e)
+                error = e
+        raise error
+
+    def _cache_key(self, backend):
+        return self.cache.make_key(self.text, backend, self._model(backend), self._prompt_template(backend))
+
+    def _model(self, backend):
+        return self.engine.tiers.tiers[self.tiers[backend]][1]
+
+    def _max_tokens(self, backend):
+        return self.engine.tiers.max_tokens(self.tiers[backend], self.quick)
+
+    def _prompt_template(self, backend):
+        return QUICK_PROMPT_TEMPLATE if self.conversation.quick else BACKEND_MODELS[backend][1]
+
+    async def _generate(self, backends):
+        """Run the request on ``backends`` in order; returns (backend, response).
+
+        The next backend is started when the current one fails before its first
+        token, or, with hedging, when it has produced no token by the router's
+        deadline. The first backend to emit a token wins and the rest are
+        cancelled. Once text is on screen a failure is final, since switching
+        backends would splice two answers together.
+        """
+        router, policy = self.engine.router, self.engine.tiers
+        waiting = list(backends)
+        tasks = self._backend_tasks
+        errors = []
+        hedged = False
+
+        def launch():
+            backend = waiting.pop(0)
+            log.info("Using %s (%s tier) for processing", backend, self.tiers[backend])
+            self.trace.mark("backend", backend=backend, tier=self.tiers[backend])
+            self.engine.tiers.record_chosen(self.tiers[backend])
+            tasks[backend] = asyncio.ensure_future(self._process(backend))
+            return backend
+
+        current = launch()
+        try:
+            while tasks:
+                deadline = (router.hedge_deadline(policy.stats[self.tiers[current]])
+                            if self.hedge and waiting and self.winner is None else None)
+                done, _ = await asyncio.wait(list(tasks.values()), timeout=deadline,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if self.winner is None and waiting:
+                        log.info("No %s token after %.2f s, hedging with %s", current, deadline, waiting[0])
+                        self.trace.mark("hedge", after=current)
+                        router.hedges_started += 1
+                        hedged = True
+                        current = launch()
+                    continue
+
+                for backend, task in list(tasks.items()):
+                    if task not in done:
+                        continue
+                    del tasks[backend]
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None:
+                        if self.winner in (None, backend):
+                            if hedged and backend != backends[0]:
+                                router.hedges_won += 1
+                            return backend, task.result()
+                        continue
+                    if self.winner == backend:
+                        raise error
+                    log.warning("%s failed before its first token: %s", backend, error)
+                    errors.append(error)
+
+                if not tasks and waiting and self.winner is None:
+                    current = launch()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        raise errors[-1] if errors else RuntimeError("No backend available")
+
+    async def _process(self, backend):
+        async with self.engine.scheduler.slot(backend, self):
+            while True:
+                try:
+                    return await self._stream_from(backend)
+                except Exception as e:
+                    policy = self.engine.tiers
+                    # A tier whose model is missing hands the request to another tier of the same backend
+                    fallback = policy.fallback(self.tiers[backend]) if policy.is_missing_model(e) else None
+                    if fallback is None or self.winner is not None:
+                        raise
+                    log.info("%s has no %s model, using the %s tier", backend, self.tiers[backend], fallback)
+                    self.trace.mark("tier_fallback", backend=backend, tier=fallback)
+                    self.tiers[backend] = fallback
+
+    async def _stream_from(self, backend):
+        policy, tier = self.engine.tiers, self.tiers[backend]
+        started = time.perf_counter()
+        try:
+            if backend == "gemini":
+                response = await self._process_with_gemini()
+            else:
+                response = await self._process_with_ollama()
+        except asyncio.CancelledError:
+            if self.winner not in (None, backend):
+                policy.record_lost(tier, time.perf_counter() - started)
+            raise
+        except Exception as e:
+            policy.record_error(tier, e)
+            metrics.incr(f"backend_errors.{backend}")
+            if backend == "gemini" and self.connectivity is not None and is_network_error(e):
+                self.connectivity.report_failure()
+            raise
+
+        if backend == "gemini" and self.connectivity is not None:
+            self.connectivity.report_success()
+        if self.winner == backend and response:
+            finished = time.perf_counter()
+            generation_seconds = max(finished - self.first_token_at, 1e-3)
+            tokens_per_second = len(response) / CHARS_PER_TOKEN / generation_seconds
+            policy.record_success(tier, self.first_token_at - started, tokens_per_second, finished - started)
+        return response
+
+    def _answer_from_cache(self, response):
+        self._replay_cached(response)
+        if self.running:
+            self.outcome = "done"
+            self.on_result(response)
+
+    def _replay_cached(self, response, words_per_chunk=8):
+        # Feed the cached answer through on_chunk so the overlay renders it like a live stream
+        words = re.split(r'(?<=\s)(?=\S)', response)
+        for i in range(0, len(words), words_per_chunk):
+            if not self.running:
+                return
+            self._emit_chunk("cache", ''.join(words[i:i + words_per_chunk]))
+
+    def _emit_chunk(self, backend, content):
+        if self.winner is None:
+            # The first backend to produce text wins; a hedged loser is cancelled
+            self.winner = backend
+            self.first_token_at = time.perf_counter()
+            latency = self.first_token_at - self.requested_at
+            self.engine.record_first_token(backend, latency)
+            log.info("First %s token after %.0f ms", backend, latency * 1000)
+            self.trace.mark("first_token", backend=backend)
+            for other, task in self._backend_tasks.items():
+                if other != backend:
+                    task.cancel()
+        elif backend != self.winner:
+            return
+        self.chunks += 1
+        self.on_chunk(content)
+
+    async def _stream_chunks(self, backend, stream, content_of):
+        """Emit every chunk of ``stream`` through on_chunk and return the full text.
+
+        Both backends end the same way: the stream is closed whether it ran
+        out, was cancelled or failed, and the accumulated text is returned.
+        """
+        accumulated_response = []
+        try:
+            async for chunk in stream:
+                if not self.running:
+                    log.info("%s generation cancelled", backend)
+                    break
+                chunk_content = content_of(chunk)
+                if not chunk_content:
+                    continue
+                accumulated_response.append(chunk_content)
+                self._emit_chunk(backend, chunk_content)
+                # While paused the backend's response is not read, so TCP slows the backend down too
+                await self.drain()
+        except Exception as e:
+            log.warning("%s error: %s", backend, e)
+            raise
+        finally:
+            # Closing the stream closes the HTTP response, so the backend stops generating
+            await stream.aclose()
+        return ''.join(accumulated_response)
+
+    def _is_online(self):
+        if self.connectivity is None:
+            return True
+        if not self.connectivity.online:
+            log.info("No internet connection detected")
+            return False
+        return True
+
+    async def _process_with_ollama(self):
+        try:
+            model = self._model("ollama")
+            self.engine.note_model(model)
+            stream = await self.engine.ollama_client().chat(
+                model=model,
+                messages=self.conversation.messages(self._prompt_template("ollama"), self.history),
+                stream=True,
+                keep_alive=self.engine.ollama_keep_alive,
+                options={'num_predict': self._max_tokens("ollama")}
+            )
+        except Exception as e:
+            log.warning("ollama error: %s", e)
+            raise
+
+        def content_of(chunk):
+            # The final chunk carries Ollama's timings, including any model load this request paid for
+            if chunk.get('done') and chunk.get('load_duration'):
+                load_seconds = chunk['load_duration'] / 1e9
+                if load_seconds > 0.5:
+                    log.info("Request waited %.0f ms for %s to load", load_seconds * 1000, model)
+                    self.engine.record_model_load(load_seconds)
+            return chunk['message']['content']
+
+        return await self._stream_chunks("ollama", stream, content_of)
+
+    async def _process_with_gemini(self):
+        from langchain_core.messages import AIMessage, HumanMessage
+        model = self.engine.gemini_model(self._model("gemini"))
+        messages = [
+            HumanMessage(content=m['content']) if m['role'] == 'user' else AIMessage(content=m['content'])
+            for m in self.conversation.messages(self._prompt_template("gemini"), self.history)
+        ]
+        generation_config = {'max_output_tokens': self._max_tokens("gemini")}
+        stream = model.astream(messages, generation_config=generation_config)
+        return await self._stream_chunks("gemini", stream, lambda chunk: chunk.content)
+
+
+class AwaitableProcessor(TextProcessor):
+    """A TextProcessor that code on the engine loop awaits instead of hooking.
+
+    ``await processor.answer()`` runs the request to the end and returns the
+    response, or None with the error shown to the user in ``error_message``.
+    Cancelling the awaiting task stops the request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done = asyncio.get_running_loop().create_future()
+        self.response = None
+        self.error_message = None
+
+    def on_result(self, response):
+        self.response = response
+
+    def on_error(self, message):
+        self.error_message = message
+
+    def on_finished(self):
+        if not self.done.done():
+            self.done.set_result(self.response)
+
+    async def answer(self):
+        self.start()
+        try:
+            return await self.done
+        except asyncio.CancelledError:
+            self.stop()
+            raise
+
+
+class QueueDrainer:
+    """Answers the requests in a RequestQueue once a backend is reachable again.
+
+    Runs as a task on the engine loop. Each round answers up to
+    ``batch_size`` queued requests concurrently, without hedging, and the next
+    round starts ``batch_interval`` seconds later, which bounds the drain rate
+    after an outage. While everything still fails for lack of a backend,
+    rounds back off from ``min_backoff`` to ``max_backoff`` seconds and try a
+    single request to see whether one is back. Queued requests are
+    speculative work to the scheduler, so anything the user asks for first
+    preempts them. ``wake``
+    brings the next round forward, e.g. as soon as a live request succeeds.
+    ``on_answered(count)`` is called on the engine thread after a round that
+    answered something.
+    """
+
+    def __init__(self, queue, engine, use_gemini=False, cache=None, connectivity=None, batch_size=4,
+                 batch_interval=5.0, min_backoff=15.0, max_backoff=600.0, on_answered=None):
+        self.queue = queue
+        self.engine = engine
+        self.use_gemini = use_gemini
+        self.cache = cache
+        self.connectivity = connectivity
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.on_answered = on_answered
+        self.drained = 0
+        self.rounds = 0
+        self.busy_seconds = 0.0
+        self._due = None
+        self._changed = None
+        self._task = None
+
+    def start(self):
+        self.engine.call_soon(self._spawn)
+
+    def _spawn(self):
+        self._changed = asyncio.Event()
+        # Requests left over from an earlier session are tried straight away
+        self._due = time.monotonic()
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        self.engine.call_soon(self._cancel)
+
+    def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def wake(self, delay=0.0):
+        """Start the next round within ``delay`` seconds, or sooner if one is already due."""
+        self.engine.call_soon(self._wake_up, delay)
+
+    def _wake_up(self, delay):
+        due = time.monotonic() + delay
+        if self._due is None or due < self._due:
+            self._due = due
+            if self._changed is not None:
+                self._changed.set()
+
+    async def _run(self):
+        backoff = self.min_backoff
+        while True:
+            while self._due is None or self._due > time.monotonic():
+                timeout = None if self._due is None else self._due - time.monotonic()
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._due = None
+            probing = backoff > self.min_backoff
+            batch = await asyncio.to_thread(self.queue.pending, 1 if probing else self.batch_size)
+            if not batch:
+                continue  # nothing to do until woken
+            answered, unavailable = await self._drain(batch)
+            if unavailable and not answered:
+                log.info("Queued requests still unanswerable; retrying in %.0f s", backoff)
+                self._due = time.monotonic() + backoff
+                backoff = min(backoff * 2, self.max_backoff)
+            else:
+                backoff = self.min_backoff
+                self._due = time.monotonic() + self.batch_interval
+
+    async def _drain(self, batch):
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(self._answer(*request) for request in batch))
+        elapsed = time.perf_counter() - started
+        answered = outcomes.count("done")
+        self.rounds += 1
+        self.busy_seconds += elapsed
+        self.drained += answered
+        metrics.observe("offline_queue.round", elapsed)
+        if answered:
+            metrics.incr("offline_queue.drained", answered)
+            log.info("Answered %d of %d queued requests in %.1f s", answered, len(batch), elapsed)
+            if self.on_answered is not None:
+                self.on_answered(answered)
+        return answered, outcomes.count("unavailable")
+
+    async def _answer(self, key, text, quick):
+        processor = AwaitableProcessor(Conversation(text, quick=quick), self.engine, use_gemini=self.use_gemini,
+                                       cache=self.cache, connectivity=self.connectivity,
+                                       trace=tracer.start("queued", chars=len(text)), hedge=False,
+                                       priority=SPECULATIVE, source="queued")
+        response = await processor.answer()
+        if response:
+            await asyncio.to_thread(self.queue.complete, key, processor.winner, response)
+            return "done"
+        if processor.outcome == "preempted":
+            return "preempted"  # stays pending for the next round
+        if processor.error is not None and is_network_error(processor.error):
+            return "unavailable"
+        await asyncio.to_thread(self.queue.fail, key, str(processor.error or "No response received from AI model"))
+        return "error"
+
+    def stats(self):
+        return {
+            'drained': self.drained,
+            'rounds': self.rounds,
+            'items_per_second': round(self.drained / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+        }
@@ -0,0 +1,398 @@
+"""Headless Sparkle AI: the processing core behind a local request API.
+
+Runs without a tray or clipboard. Editors and scripts send text over a Unix
+socket (the default where available) or localhost HTTP and get the answer
+streamed back, so many small tools share one engine and one warm model.
+
+    python daemon.py                        # Unix socket at ~/.sparkience/sparkle.sock
+    python daemon.py --port 8765            # http://127.0.0.1:8765
+
+    curl --unix-socket ~/.sparkience/sparkle.sock localhost/v1/analyze \\
+         -H 'X-Client-Id: vim' -d '{"text": "SIGSEGV in libc"}'
+
+API (HTTP/1.1, one request per connection):
+
+- ``POST /v1/analyze`` with ``{"text": ..., "history": [...], "backend": "auto"|"ollama",
+  "latency_budget": seconds, "stream": true}``. Streams newline-delimited JSON:
+  ``{"chunk": ...}`` lines, then ``{"done": true, "response": ..., "backend": ..., "tier": ...}``
+  or ``{"error": ...}``. ``latency_budget`` steers which model tier answers.
+- ``GET /v1/health`` and ``GET /v1/stats``.
+
+At most ``--max-concurrent`` requests run at once. The rest wait in a queue per
+client (``X-Client-Id`` header, else the connection) and clients take turns as
+slots free up. A client with ``--max-queued-per-client`` requests waiting, or a
+full daemon, gets ``429`` with ``Retry-After`` instead of an ever-growing queue.
+A backend stream is only read as fast as its client reads the answer.
+"""
+import os
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import threading
+import itertools
+from http import HTTPStatus
+from pathlib import Path
+
+import core
+from core import BackendEngine, ConnectivityMonitor, Conversation, ResponseCache, SemanticCache
+from tracing import log, metrics, tracer, configure_logging
+
+DEFAULT_SOCKET = core.DATA_DIR / "sparkle.sock"
+MAX_BODY_BYTES = 8 * 1024 * 1024
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Admission:
+    """A request's place in the daemon's queue; its client is the owner that takes turns."""
+    # Every request is of the same class, so none is ever preempted
+    priority = core.COPY
+
+    def __init__(self, client):
+        self.owner = client
+
+    def preempt(self):
+        pass
+
+
+class RequestScheduler(core.PriorityScheduler):
+    """Admits requests up to ``max_concurrent`` at a time, taking turns between clients.
+
+    Requests share the one ``requests`` slot pool of a PriorityScheduler, so
+    each client has its own FIFO queue and when a slot frees up the next
+    client in round-robin order gets it. A request that would wait behind
+    ``max_queued_per_client`` of its client's, or ``max_queued`` in all,
+    raises QueueFull instead. Must be used from a single event loop.
+    """
+    POOL = "requests"
+
+    def __init__(self, max_concurrent=2, max_queued_per_client=8, max_queued=64):
+        super().__init__(name="daemon.queue")
+        self.limits = {self.POOL: max_concurrent}
+        self.max_queued_per_client = max_queued_per_client
+        self.max_queued = max_queued
+        self.rejected = 0
+
+    def _waiting(self):
+        return self._queues.get(self.POOL, {}).get(Admission.priority, {})
+
+    def admit(self, client):
+        """The ``async with`` context holding a request slot for ``client``; raises QueueFull if it cannot queue."""
+        waiting = self._waiting()
+        if len(self.holders.get(self.POOL, ())) >= self.limits[self.POOL] and (
+                len(waiting.get(client, ())) >= self.max_queued_per_client
+                or sum(len(entries) for entries in waiting.values()) >= self.max_queued):
+            self.rejected += 1
+            raise QueueFull()
+        return self.slot(self.POOL, Admission(client))
+
+    def stats(self):
+        waiting = self._waiting()
+        return {
+            'active': len(self.holders.get(self.POOL, ())),
+            'queued': sum(len(entries) for entries in waiting.values()),
+            'queued_by_client': {client: len(entries) for client, entries in waiting.items()},
+            'admitted': self.admitted[Admission.priority],
+            'rejected': self.rejected,
+            'wait': super().stats()['wait'][Admission.priority],
+        }
+
+
+class StreamingProcessor(core.TextProcessor):
+    """Hands a request's output to the connection serving it.
+
+    The hooks run on the engine loop, which is also the loop the server runs
+    on, so they can feed an asyncio queue directly. Once ``max_buffered``
+    chunks are waiting to be sent, ``drain`` holds the backend stream until
+    the connection has taken some.
+    """
+
+    def __init__(self, *args, max_buffered=32, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Not bounded itself: the result and finished events must always fit behind the chunks
+        self.events = asyncio.Queue()
+        self.max_buffered = max_buffered
+        self._room = asyncio.Event()
+        self._room.set()
+
+    async def next_event(self):
+        event = await self.events.get()
+        if self.events.qsize() < self.max_buffered:
+            self._room.set()
+        return event
+
+    async def drain(self):
+        await self._room.wait()
+
+    def on_chunk(self, content):
+        self.events.put_nowait(('chunk', content))
+        if self.events.qsize() >= self.max_buffered:
+            self._room.clear()
+
+    def on_result(self, response):
+        self.events.put_nowait(('result', response))
+
+    def on_error(self, message):
+        self.events.put_nowait(('error', message))
+
+    def on_finished(self):
+        self.events.put_nowait(('finished', None))
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Daemon:
+    """Serves analysis requests from a Unix socket or a localhost TCP port on the engine loop."""
+
+    def __init__(self, engine, scheduler, use_gemini=True, cache=None, connectivity=None, semantic_cache=None):
+        self.engine = engine
+        self.scheduler = scheduler
+        self.use_gemini = use_gemini
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.connectivity = connectivity
+        self.started_at = time.time()
+        self._server = None
+        self._connection_ids = itertools.count(1)
+
+    async def start(self, socket_path=None, host="127.0.0.1", port=None):
+        if port is None:
+            socket_path.parent.mkdir(parents=True, exist_ok=True)
+            if socket_path.exists():
+                socket_path.unlink()
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=str(socket_path))
+            os.chmod(socket_path, 0o600)
+            log.info("Listening on %s", socket_path)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+            log.info("Listening on http://%s:%d", host, port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        connection = f"connection-{next(self._connection_ids)}"
+        try:
+            method, path, headers, body = await self._read_request(reader)
+            client = headers.get('x-client-id') or connection
+            if method == "POST" and path == "/v1/analyze":
+                await self._analyze(client, body, writer)
+            elif method == "GET" and path == "/v1/health":
+                self._send_json(writer, 200, {'status': 'ok', **self.scheduler.stats()})
+            elif method == "GET" and path == "/v1/stats":
+                self._send_json(writer, 200, self.stats())
+            else:
+                raise HTTPError(404, f"No route for {method} {path}")
+        except HTTPError as e:
+            self._send_json(writer, e.status, {'error': str(e)}, e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            log.error("Daemon request failed: %s", e)
+            self._send_json(writer, 500, {'error': str(e)})
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        try:
+            method, target, _ = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Length must be a number")
+        if length < 0:
+            raise HTTPError(400, "Content-Length must not be negative")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Request body over {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    async def _analyze(self, client, body, writer):
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(400, "Body must be JSON")
+        if not isinstance(request, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        text = request.get('text')
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(400, "'text' must be a non-empty string")
+        history = request.get('history') or []
+        if not isinstance(history, list) or not all(
+                isinstance(turn, dict) and isinstance(turn.get('content', ''), str) for turn in history):
+            raise HTTPError(400, "'history' must be a list of objects with a string 'content'")
+        conversation = Conversation(text)
+        for turn in history:
+            if turn.get('role') == 'assistant':
+                conversation.add_assistant(turn.get('content', ''))
+            else:
+                conversation.add_user(turn.get('content', ''))
+        use_gemini = self.use_gemini and request.get('backend', 'auto') != 'ollama'
+        latency_budget = request.get('latency_budget')
+        if latency_budget is not None and (isinstance(latency_budget, bool)
+                                           or not isinstance(latency_budget, (int, float)) or latency_budget <= 0):
+            raise HTTPError(400, "'latency_budget' must be a positive number of seconds")
+        stream = request.get('stream', True)
+
+        trace = tracer.start("daemon", client=client, chars=len(text))
+        try:
+            admission = self.scheduler.admit(client)
+        except QueueFull:
+            trace.finish("rejected")
+            raise HTTPError(429, "Too many queued requests", {'Retry-After': '1'})
+
+        async with admission:
+            trace.mark("admitted")
+            processor = StreamingProcessor(conversation, self.engine, use_gemini=use_gemini, cache=self.cache,
+                                           connectivity=self.connectivity, trace=trace,
+                                           semantic_cache=self.semantic_cache, latency_budget=latency_budget,
+                                           source="daemon")
+            try:
+                processor.start()
+                if stream:
+                    self._write_head(writer, 200, 'application/x-ndjson', {'Transfer-Encoding': 'chunked'})
+                await self._relay(processor, writer, stream)
+            finally:
+                # A client that hangs up mid-answer cancels its request
+                processor.stop()
+
+    async def _relay(self, processor, writer, stream):
+        while True:
+            kind, value = await processor.next_event()
+            if kind == 'chunk':
+                if stream:
+                    self._write_chunk(writer, {'chunk': value})
+                    # Waiting for the client to read is the backpressure on this request
+                    await writer.drain()
+            elif kind == 'result':
+                final = {'done': True, 'response': value, 'backend': processor.winner,
+                         'tier': processor.tiers.get(processor.winner)}
+                if stream:
+                    self._write_chunk(writer, final)
+                else:
+                    self._send_json(writer, 200, final)
+            elif kind == 'error':
+                if stream:
+                    self._write_chunk(writer, {'error': value})
+                else:
+                    self._send_json(writer, 502, {'error': value})
+            elif kind == 'finished':
+                break
+        if stream:
+            writer.write(b"0\r\n\r\n")
+
+    def stats(self):
+        return {
+            'uptime_seconds': round(time.time() - self.started_at),
+            'scheduler': self.scheduler.stats(),
+            'first_token': self.engine.first_token_stats(),
+            'routing': self.engine.router.snapshot(),
+            'tiers': self.engine.tiers.snapshot(),
+            'response_cache': self.cache.stats() if self.cache is not None else None,
+            'semantic_cache': self.semantic_cache.stats() if self.semantic_cache is not None else None,
+            'metrics': metrics.snapshot(),
+        }
+
+    @staticmethod
+    def _write_head(writer, status, content_type, headers=None):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}",
+                 "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+
+    @staticmethod
+    def _write_chunk(writer, payload):
+        line = json.dumps(payload).encode() + b"\n"
+        writer.write(b"%x\r\n%s\r\n" % (len(line), line))
+
+    def _send_json(self, writer, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self._write_head(writer, status, 'application/json', {'Content-Length': len(data), **(headers or {})})
+        writer.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", type=Path, default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--port", type=int, help="serve HTTP on 127.0.0.1:PORT instead of a Unix socket")
+    parser.add_argument("--max-concurrent", type=int, default=2, help="requests generating at once")
+    parser.add_argument("--max-queued-per-client", type=int, default=8)
+    parser.add_argument("--max-queued", type=int, default=64)
+    parser.add_argument("--no-gemini", action="store_true", help="answer with the local Ollama model only")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the response caches")
+    args = parser.parse_args()
+    if args.port is None and not hasattr(socket, "AF_UNIX"):
+        parser.error("Unix sockets are not available here; pass --port")
+
+    configure_logging()
+    engine = BackendEngine()
+    engine.tiers = core.TierPolicy.from_file(core.DATA_DIR / "model_tiers.json")
+    # The daemon's RequestScheduler already decides how many requests run; backend slots must not cut that further
+    engine.scheduler = core.PriorityScheduler(dict.fromkeys(core.BACKEND_CONCURRENCY, args.max_concurrent))
+    engine.start()
+    connectivity = None
+    if not args.no_gemini:
+        connectivity = ConnectivityMonitor()
+        connectivity.start()
+    cache = None if args.no_cache else ResponseCache()
+    semantic_cache = None if args.no_cache else SemanticCache()
+    scheduler = RequestScheduler(args.max_concurrent, args.max_queued_per_client, args.max_queued)
+    daemon = Daemon(engine, scheduler, use_gemini=not args.no_gemini, cache=cache, connectivity=connectivity,
+                    semantic_cache=semantic_cache)
+
+    engine.submit(daemon.start(args.socket, port=args.port)).result()
+    # Load the models now so the first request does not pay for it
+    engine.submit(engine.warm_tiers())
+
+    stopping = threading.Event()
+    for name in ("SIGINT", "SIGTERM"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda signum, frame: stopping.set())
+    while not stopping.wait(0.5):
+        pass
+
+    log.info("Shutting down")
+    try:
+        engine.submit(daemon.stop()).result(5)
+    except Exception as e:
+        log.warning("Daemon shutdown: %s", e)
+    engine.stop()
+    if cache is not None:
+        cache.close()
+        semantic_cache.close()
+    if connectivity is not None:
+        connectivity.stop()
+    if args.port is None and args.socket.exists():
+        args.socket.unlink()
+    log.info("Daemon stats: %s", daemon.stats())
+
+
+if __name__ == "__main__":
+    main()
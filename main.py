@@ -1,29 +1,47 @@
 import sys
 import os
+import time
+import sqlite3
+import tempfile
+import itertools
+from collections import OrderedDict, deque
 import keyboard
-import pyperclip
-import win32gui
-import win32con
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QLabel, QPushButton, QSystemTrayIcon, QMenu, QFrame,
-                            QGraphicsOpacityEffect, QScrollArea)
+                            QGraphicsOpacityEffect, QListView, QStyledItemDelegate, QAbstractItemView)
 from PyQt6.QtWidgets import QLineEdit, QHBoxLayout, QWidgetAction
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QPoint, QPropertyAnimation, QEasingCurve, QTimer
-from PyQt6.QtGui import QIcon, QFont, QFontDatabase, QCursor, QColor, QPixmap, QPainter
-import requests
+from PyQt6.QtCore import (Qt, QObject, pyqtSignal, QPoint, QPointF, QRectF, QSize, QPropertyAnimation,
+                          QEasingCurve, QTimer, QAbstractListModel, QModelIndex)
+from PyQt6.QtGui import (QIcon, QFont, QFontDatabase, QCursor, QColor, QPixmap, QPainter, QTextLayout,
+                         QTextOption)
 from pathlib import Path
-import json
-import ollama
-from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
 
-import datetime
+import core
+from tracing import log, metrics, tracer, configure_logging, export_diagnostics
+from core import (BackendEngine, ConnectivityMonitor, Conversation, ResponseCache, SemanticCache, RequestQueue,
+                  QueueDrainer, TierPolicy, PriorityScheduler, PRIORITY_CLASSES, CHAT, COPY,
+                  SPECULATIVE)
+from prefilter import InputFilter, DROP, QUICK
 
 
-def debug_print(message):
-    timestamp = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
-    print(f"[DEBUG {timestamp}] {message}")
-    sys.stdout.flush()  # Force immediate output
+# Streamed chunks are rendered at most once per frame (~60 Hz)
+FRAME_INTERVAL_MS = 16
+
+# A selection unchanged for this long is answered speculatively
+SELECTION_STABLE_MS = 600
+
+# Copied text shown in the conversation is cut to this length; the model still gets all of it
+MESSAGE_PREVIEW_CHARS = 1000
+
+# Closing the overlay turns the assistant off for this long
+CLOSE_PAUSE_MS = 3000
+
+# An assistant left off this long releases the overlay and unloads the model
+IDLE_RELEASE_MS = 10000
+
+# Seconds an answer in the overlay should take in full; model tiers expected to be slower are tried last
+LATENCY_BUDGET_SECONDS = 12.0
+
 
 class AnimatedLabel(QLabel):
     def __init__(self, *args, **kwargs):
@@ -52,99 +70,283 @@ class AnimatedLabel(QLabel):
                 self.opacity_effect.setOpacity(1.0)
 
 
-# In TextProcessor class, add a stop method
-class TextProcessor(QThread):
+class TextProcessor(core.TextProcessor, QObject):
+    """Qt front end for core.TextProcessor.
+
+    The core calls its hooks on the backend engine thread; re-emitting them as
+    signals queues them onto the GUI thread.
+    """
     result_ready = pyqtSignal(str)
     chunk_ready = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
-    
-    def __init__(self, text, use_gemini=False):
-        super().__init__()
-        self.text = text
-        self.use_gemini = use_gemini
-        self.running = True
+    progress = pyqtSignal(int, int)
+    queued = pyqtSignal()
+    finished = pyqtSignal()
+
+    def __init__(self, *args, **kwargs):
+        QObject.__init__(self)
+        core.TextProcessor.__init__(self, *args, **kwargs)
         os.environ['GOOGLE_API_KEY'] = ''
-    
-    def stop(self):
-        self.running = False
-        self.wait()  # Wait for the thread to finish
-    
-    def run(self):
-        try:
-            if not self.running:
+
+    def on_chunk(self, content):
+        self.chunk_ready.emit(content)
+
+    def on_result(self, response):
+        self.result_ready.emit(response)
+
+    def on_error(self, message):
+        self.error_occurred.emit(message)
+
+    def on_progress(self, done, total):
+        self.progress.emit(done, total)
+
+    def on_queued(self):
+        self.queued.emit()
+
+    def on_finished(self):
+        self.finished.emit()
+
+
+class InputPipeline(QObject):
+    """Debounces and deduplicates clipboard and selection events.
+
+    Events are held for ``debounce_ms`` and only the last one in a burst is
+    dispatched through ``text_ready``, together with the trace opened when it
+    arrived. Text identical to the previous dispatch is dropped for
+    ``dedupe_seconds`` regardless of which source it came from. A selection
+    differing from it by fewer than ``min_change_chars`` characters (a drag
+    still settling) is dropped too; explicit copies always go through, since
+    copying "error 403" right after "error 404" is a new question.
+    """
+    text_ready = pyqtSignal(str, str, object)
+
+    def __init__(self, debounce_ms=350, min_change_chars=3, dedupe_seconds=10, parent=None):
+        super().__init__(parent)
+        self.debounce_ms = debounce_ms
+        self.min_change_chars = min_change_chars
+        self.dedupe_seconds = dedupe_seconds
+        self.received = 0
+        self.dispatched = 0
+        self.dropped_debounced = 0
+        self.dropped_duplicate = 0
+        self.dropped_minor = 0
+        self._pending = None
+        self._last_text = None
+        self._last_dispatch_time = 0.0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._dispatch)
+
+    def submit(self, text, source):
+        self.received += 1
+        trace = tracer.start(source, chars=len(text))
+        if self._pending is not None:
+            self.dropped_debounced += 1
+            self._pending[2].finish("debounced")
+        self._pending = (text, source, trace)
+        self._timer.start(self.debounce_ms)
+
+    def clear(self):
+        self._timer.stop()
+        if self._pending is not None:
+            self._pending[2].finish("cleared")
+        self._pending = None
+
+    def _dispatch(self):
+        if self._pending is None:
+            return
+        text, source, trace = self._pending
+        self._pending = None
+
+        normalized = " ".join(text.split())
+        if self._last_text is not None and time.monotonic() - self._last_dispatch_time < self.dedupe_seconds:
+            if normalized == self._last_text:
+                self.dropped_duplicate += 1
+                trace.finish("duplicate")
+                return
+            if source == "selection" and self._changed_chars(self._last_text, normalized) < self.min_change_chars:
+                self.dropped_minor += 1
+                trace.finish("minor_edit")
                 return
-                
-            debug_print(f"Starting text processing thread") 
-            if self.use_gemini and self._check_internet():
-                debug_print("Using Gemini for processing")
-                response = self._process_with_gemini()
-            else:
-                debug_print("Using Ollama for processing")
-                response = self._process_with_ollama()
-            
-            if response and self.running:
-                debug_print("Processing completed successfully")
-                self.result_ready.emit(response)
-            elif self.running:
-                self.error_occurred.emit("No response received from AI model")
-        except Exception as e:
-            if self.running:
-                debug_print(f"Error in TextProcessor: {str(e)}")
-                self.error_occurred.emit(f"Error processing text: {str(e)}")
-
-
-    def _check_internet(self):
-        try:
-            requests.get("http://www.google.com", timeout=3)
-            return True
-        except requests.RequestException:
-            debug_print("No internet connection detected")
-            return False
 
-    def _process_with_ollama(self):
-        try:
-            accumulated_response = ""
-            stream = ollama.chat(
-                model='llama3.2:3b',
-                messages=[{
-                    'role': 'user',
-                    'content': f"Analyze this text and provide a relevant explanation: {self.text}"
-                }],
-                stream=True
-            )
-            
-            for chunk in stream:
-                chunk_content = chunk['message']['content']
-                accumulated_response += chunk_content
-                self.chunk_ready.emit(chunk_content)
-                debug_print(f"Emitted chunk: {chunk_content[:50]}...")
-            
-            return accumulated_response
-            
-        except Exception as e:
-            debug_print(f"Ollama error: {str(e)}")
-            raise
+        self._last_text = normalized
+        self._last_dispatch_time = time.monotonic()
+        self.dispatched += 1
+        log.debug("Dispatching %s text (%s)", source, self.stats())
+        trace.mark("dispatched")
+        self.text_ready.emit(text, source, trace)
 
-    def _process_with_gemini(self):
-        try:
-            debug_print("Initializing Gemini model")
-            model = ChatGoogleGenerativeAI(model="models/gemini-1.5-flash")
-            prompt_template = """
-            Analyze the following text and provide a relevant explanation. 
-            If the text appears to be from a casual context, provide a conversational response.
-            If the text is technical or formal, provide a concise, professional explanation.
-            
-            Text to analyze: {text}
-            """
-            prompt = prompt_template.format(text=self.text)
-            message = HumanMessage(content=prompt)
-            response = model.stream([message])
-            result = ''.join([r.content for r in response])
-            debug_print(f"Gemini response received: {result[:50]}...")
-            return result
-        except Exception as e:
-            debug_print(f"Gemini error: {str(e)}")
-            raise
+    def dispatched_recently(self, text):
+        """True if ``text`` is what this pipeline dispatched last, within ``dedupe_seconds``."""
+        return (" ".join(text.split()) == self._last_text
+                and time.monotonic() - self._last_dispatch_time < self.dedupe_seconds)
+
+    @staticmethod
+    def _changed_chars(old, new):
+        # Size of the edited region once the common prefix and suffix are removed
+        prefix = len(os.path.commonprefix([old, new]))
+        suffix = len(os.path.commonprefix([old[prefix:][::-1], new[prefix:][::-1]]))
+        return max(len(old), len(new)) - prefix - suffix
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'dispatched': self.dispatched,
+            'dropped_debounced': self.dropped_debounced,
+            'dropped_duplicate': self.dropped_duplicate,
+            'dropped_minor': self.dropped_minor,
+        }
+
+
+class Speculation:
+    """A prefetched answer for one selected text, buffered until it is shown.
+
+    Once promoted, ``forward`` passes the rest of the stream straight to the
+    overlay; chunks that arrived before that are in ``chunks``.
+    """
+
+    def __init__(self, conversation, processor):
+        self.conversation = conversation
+        self.processor = processor
+        self.chunks = []
+        self.response = None
+        self.done = False
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._on_chunk = self._on_result = self._on_error = None
+        processor.chunk_ready.connect(self._chunk)
+        processor.result_ready.connect(self._result)
+        processor.error_occurred.connect(self._error)
+
+    def forward(self, on_chunk, on_result, on_error):
+        self._on_chunk, self._on_result, self._on_error = on_chunk, on_result, on_error
+
+    def _chunk(self, content):
+        self.chunks.append(content)
+        if self._on_chunk is not None:
+            self._on_chunk(content)
+
+    def _result(self, response):
+        self.response = response
+        if self._on_result is not None:
+            self._on_result(response)
+
+    def _error(self, message):
+        if self._on_error is not None:
+            self._on_error(message)
+
+
+class Prefetcher(QObject):
+    """Answers stable selections in the background so that copying them is instant.
+
+    ``prefetch`` starts a hidden request for a selected text. At most
+    ``max_concurrent`` run at once; beyond that the oldest is cancelled, since
+    the newest selection is the one most likely to be copied. They run in the
+    scheduler's speculative class, so any answer the user asks for preempts
+    them when a backend has no slot to spare. Finished answers
+    are kept for ``ttl_seconds``, at most ``max_results`` of them, and ``take``
+    hands over the one for a copied text whether it is still streaming or not.
+    ``hit_rate`` is the share of speculations that were used.
+    """
+
+    def __init__(self, create_processor, retire_processor, max_concurrent=1, max_results=4,
+                 ttl_seconds=120, parent=None):
+        super().__init__(parent)
+        self.create_processor = create_processor
+        self.retire_processor = retire_processor
+        self.max_concurrent = max_concurrent
+        self.max_results = max_results
+        self.ttl_seconds = ttl_seconds
+        self.speculations = OrderedDict()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.discarded = 0
+
+    @staticmethod
+    def key(text):
+        return " ".join(text.split())
+
+    def prefetch(self, text, conversation, trace):
+        key = self.key(text)
+        if key in self.speculations:
+            trace.finish("duplicate")
+            return
+        running = [k for k, speculation in self.speculations.items() if not speculation.done]
+        while len(running) >= self.max_concurrent:
+            self._discard(running.pop(0))
+        self._expire()
+
+        trace.mark("speculative")
+        processor = self.create_processor(conversation, trace, hedge=False, queue=False, priority=SPECULATIVE,
+                                          source="selection")
+        speculation = Speculation(conversation, processor)
+        processor.finished.connect(lambda: self._finished(key, speculation))
+        self.speculations[key] = speculation
+        self.started += 1
+        metrics.incr("speculative.started")
+        log.debug("Prefetching answer for selection: %.50s", key)
+        processor.start()
+
+    def take(self, text):
+        """Remove and return the speculation for ``text``, or None if there is none."""
+        self._expire()
+        speculation = self.speculations.pop(self.key(text), None)
+        if speculation is None:
+            self.misses += 1
+            metrics.incr("speculative.miss")
+            return None
+        self.hits += 1
+        metrics.incr("speculative.hit")
+        # How far ahead of the copy the answer was started: the latency saved, at most
+        metrics.observe("speculative.head_start", time.perf_counter() - speculation.started_at)
+        log.info("Using prefetched answer (%s)", "finished" if speculation.done else "streaming")
+        return speculation
+
+    def clear(self):
+        for key in list(self.speculations):
+            self._discard(key)
+
+    def _finished(self, key, speculation):
+        speculation.done = True
+        speculation.finished_at = time.perf_counter()
+        if self.speculations.get(key) is not speculation:
+            return  # promoted or already discarded
+        self.retire_processor(speculation.processor)
+        if speculation.response is None:
+            self._discard(key)
+
+    def _expire(self):
+        now = time.perf_counter()
+        finished = [k for k, speculation in self.speculations.items() if speculation.done]
+        stale = [k for k in finished if now - self.speculations[k].finished_at > self.ttl_seconds]
+        fresh = [k for k in finished if k not in stale]
+        # Beyond ``max_results`` the oldest answers go first
+        for key in stale + fresh[:max(0, len(fresh) - self.max_results)]:
+            self._discard(key)
+
+    def _discard(self, key):
+        speculation = self.speculations.pop(key)
+        if speculation.done:
+            self.discarded += 1
+            metrics.incr("speculative.discarded")
+        else:
+            self.cancelled += 1
+            metrics.incr("speculative.cancelled")
+            speculation.processor.stop()
+            self.retire_processor(speculation.processor)
+
+    def stats(self):
+        return {
+            'started': self.started,
+            'hits': self.hits,
+            'misses': self.misses,
+            'cancelled': self.cancelled,
+            'discarded': self.discarded,
+            'hit_rate': round(self.hits / self.started, 3) if self.started else None,
+        }
 
 
 class StatusIndicatorWidget(QWidget):
@@ -161,10 +363,20 @@ class StatusIndicatorWidget(QWidget):
         
         # Create text label
         self.text_label = QLabel(text)
+
+        # Secondary status, e.g. whether the local model is loaded
+        self.detail_label = QLabel()
+        self.detail_label.setStyleSheet("color: #6e7681; font-size: 11px;")
+        self.detail_label.hide()
         
         layout.addWidget(self.indicator)
         layout.addWidget(self.text_label)
+        layout.addWidget(self.detail_label)
         layout.addStretch()
+
+    def set_detail(self, text):
+        self.detail_label.setText(text)
+        self.detail_label.setVisible(bool(text))
     
     def update_status(self, active):
         # Create a colored circle
@@ -188,8 +400,383 @@ class StatusIndicatorWidget(QWidget):
         self.indicator.setPixmap(pixmap)
 
 
+class MessageStore:
+    """Finished messages of this session in a SQLite file, so the view can page them out.
+
+    Ids count up from 1 in the order messages are added. The file lives in
+    ``directory`` (not a possibly RAM-backed temp dir) and is deleted on ``close``.
+    """
+
+    def __init__(self, directory):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Files left behind by a session that did not shut down cleanly
+        for stale in directory.glob("sparkle-history-*.sqlite3"):
+            try:
+                stale.unlink()
+            except OSError:
+                pass  # still open in another instance
+        fd, self.path = tempfile.mkstemp(prefix="sparkle-history-", suffix=".sqlite3", dir=directory)
+        os.close(fd)
+        self._db = sqlite3.connect(self.path)
+        # Nothing here needs to survive a crash, so skip the journal and fsyncs
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, role TEXT, content TEXT)")
+        self.last_id = 0
+
+    def add(self, role, content):
+        self.last_id = self._db.execute("INSERT INTO messages (role, content) VALUES (?, ?)",
+                                        (role, content)).lastrowid
+        return self.last_id
+
+    def page(self, first_id, last_id):
+        return self._db.execute("SELECT id, role, content FROM messages WHERE id BETWEEN ? AND ? ORDER BY id",
+                                (first_id, last_id)).fetchall()
+
+    def close(self):
+        self._db.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Message:
+    __slots__ = ('key', 'id', 'role', 'text', 'live', 'version')
+
+    _keys = itertools.count(1)
+
+    def __init__(self, role, text, message_id=None, live=False):
+        # Layout caches are keyed on ``key``: unique for the life of the process, unlike id()
+        self.key = next(self._keys)
+        self.id = message_id
+        self.role = role
+        self.text = text
+        self.live = live
+        self.version = 0
+
+
+class ConversationModel(QAbstractListModel):
+    """Messages of the session, one row each, with at most ``max_rows`` in memory.
+
+    Finished messages are written to ``store``. Past ``max_rows`` the oldest
+    ``page_size`` rows are dropped, and ``load_older``/``load_newer`` page them
+    back in as the view scrolls while dropping rows at the other end. The answer
+    being streamed is the ``live`` row and always comes last.
+    """
+    MessageRole = Qt.ItemDataRole.UserRole
+
+    def __init__(self, store, max_rows=200, page_size=50, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.max_rows = max_rows
+        self.page_size = page_size
+        self.rows = []
+        # A view rebuilt over an earlier store opens on its latest messages
+        self._show_latest()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.rows[index.row()]
+        if role == self.MessageRole:
+            return message
+        if role == Qt.ItemDataRole.DisplayRole:
+            return message.text
+        return None
+
+    def live(self):
+        return self.rows[-1] if self.rows and self.rows[-1].live else None
+
+    def add(self, role, text):
+        self.finish_live()
+        self._show_latest()
+        self._append(Message(role, text, self.store.add(role, text)))
+
+    def append_live(self, text):
+        message = self.live()
+        if message is None:
+            self._show_latest()
+            message = Message("assistant", "", live=True)
+            self._append(message)
+        message.text += text
+        message.version += 1
+        self._changed(len(self.rows) - 1)
+
+    def finish_live(self, text=None):
+        message = self.live()
+        if message is None:
+            if text is not None:
+                self._show_latest()
+                self._append(Message("assistant", text, self.store.add("assistant", text)))
+            return
+        if text is not None and text != message.text:
+            message.text = text
+            message.version += 1
+            self._changed(len(self.rows) - 1)
+        message.live = False
+        message.id = self.store.add(message.role, message.text)
+
+    def drop_live(self):
+        if self.live() is not None:
+            row = len(self.rows) - 1
+            self.beginRemoveRows(QModelIndex(), row, row)
+            self.rows.pop()
+            self.endRemoveRows()
+
+    def has_older(self):
+        return bool(self.rows) and self.rows[0].id is not None and self.rows[0].id > 1
+
+    def has_newer(self):
+        if not self.rows:
+            return self.store.last_id > 0
+        last = self.rows[-1]
+        return last.id is not None and last.id < self.store.last_id
+
+    def load_older(self):
+        """Page in the rows before the first one; returns how far existing rows moved."""
+        if not self.has_older():
+            return 0
+        first = self.rows[0].id
+        messages = [Message(role, text, message_id) for message_id, role, text
+                    in self.store.page(max(1, first - self.page_size), first - 1)]
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self.rows[:0] = messages
+        self.endInsertRows()
+        # The answer being streamed stays; otherwise drop the newest page to stay in bounds
+        if len(self.rows) > self.max_rows and self.live() is None:
+            self._remove(self.max_rows, len(self.rows) - 1)
+        return len(messages)
+
+    def load_newer(self):
+        if not self.has_newer():
+            return 0
+        last = self.rows[-1].id
+        messages = [Message(role, text, message_id) for message_id, role, text
+                    in self.store.page(last + 1, last + self.page_size)]
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(messages) - 1)
+        self.rows.extend(messages)
+        self.endInsertRows()
+        return -self._trim()
+
+    def _show_latest(self):
+        # New messages go at the end, so a window scrolled back into history jumps forward first
+        if self.has_newer():
+            self.beginResetModel()
+            last = self.store.last_id
+            self.rows = [Message(role, text, message_id) for message_id, role, text
+                         in self.store.page(max(1, last - self.page_size + 1), last)]
+            self.endResetModel()
+
+    def _append(self, message):
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows))
+        self.rows.append(message)
+        self.endInsertRows()
+        self._trim()
+
+    def _trim(self):
+        if len(self.rows) <= self.max_rows:
+            return 0
+        count = min(self.page_size, len(self.rows) - 1)
+        self._remove(0, count - 1)
+        return count
+
+    def _remove(self, first, last):
+        self.beginRemoveRows(QModelIndex(), first, last)
+        del self.rows[first:last + 1]
+        self.endRemoveRows()
+
+    def _changed(self, row):
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+class _Layout:
+    """Laid-out lines of one message at one width, a QTextLayout per paragraph."""
+    __slots__ = ('text', 'version', 'width', 'paragraphs', 'tops', 'height')
+
+
+class MessageDelegate(QStyledItemDelegate):
+    """Paints messages from cached text layouts.
+
+    Heights are remembered per message version and width, so relaying out the
+    list costs a dictionary lookup per row. Line layouts are kept for the
+    ``max_layouts`` most recently used messages and only the paragraphs inside
+    the exposed area are drawn. While an answer streams in, only its last
+    paragraph is laid out again.
+    """
+    PADDING = 10
+    SPACING = 8
+
+    def __init__(self, view, max_layouts=64, max_sizes=4096):
+        super().__init__(view)
+        self.view = view
+        self.max_layouts = max_layouts
+        self.max_sizes = max_sizes
+        self._layouts = OrderedDict()
+        self._sizes = OrderedDict()
+
+    def _text_width(self):
+        return max(40, self.view.viewport().width() - 2 * self.PADDING)
+
+    def sizeHint(self, option, index):
+        # Called for every row on each relayout: the model's rows are read directly
+        # and sizes are cached rather than rebuilt
+        message = self.view.model().rows[index.row()]
+        width = self.view.viewport().width()
+        key = (message.key, message.version, width)
+        size = self._sizes.get(key)
+        if size is None:
+            height = self._layout(message, max(40, width - 2 * self.PADDING)).height
+            size = self._sizes[key] = QSize(width, int(height) + 2 * self.PADDING + self.SPACING)
+            if len(self._sizes) > self.max_sizes:
+                self._sizes.popitem(last=False)
+        return size
+
+    def paint(self, painter, option, index):
+        message = index.data(ConversationModel.MessageRole)
+        layout = self._layout(message, self._text_width())
+        bubble = QRectF(option.rect.adjusted(0, 0, 0, -self.SPACING))
+        visible = painter.clipBoundingRect() if painter.hasClipping() else QRectF(option.rect)
+        origin = QPointF(bubble.left() + self.PADDING, bubble.top() + self.PADDING)
+
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        if message.role == "user":
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(100, 255, 218, 20))
+            painter.drawRoundedRect(bubble, 8, 8)
+        painter.setPen(QColor("#64ffda" if message.role == "user" else "#e4e4e4"))
+        for paragraph, top in zip(layout.paragraphs, layout.tops):
+            y = origin.y() + top
+            if y > visible.bottom():
+                break
+            if y + paragraph.boundingRect().height() >= visible.top():
+                paragraph.draw(painter, origin)
+        painter.restore()
+
+    def _layout(self, message, width):
+        cached = self._layouts.get(message.key)
+        if cached is not None and cached.width == width and cached.version == message.version:
+            self._layouts.move_to_end(message.key)
+            return cached
+
+        paragraphs, tops, height = [], [], 0.0
+        # Streamed text only grows at the end: every paragraph but the last is already laid out
+        if cached is not None and cached.width == width and message.text.startswith(cached.text):
+            keep = len(cached.paragraphs) - 1
+            paragraphs, tops = cached.paragraphs[:keep], cached.tops[:keep]
+            height = cached.tops[keep]
+            start = cached.text.rfind("\n") + 1
+        else:
+            start = 0
+
+        font = self.view.font()
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
+        for text in message.text[start:].split("\n"):
+            paragraph = QTextLayout(text, font)
+            paragraph.setCacheEnabled(True)
+            paragraph.setTextOption(option)
+            paragraph.beginLayout()
+            y = height
+            while True:
+                line = paragraph.createLine()
+                if not line.isValid():
+                    break
+                line.setLineWidth(width)
+                line.setPosition(QPointF(0, y))
+                y += line.height()
+            paragraph.endLayout()
+            paragraphs.append(paragraph)
+            tops.append(height)
+            height = y
+
+        layout = _Layout()
+        layout.text, layout.version, layout.width = message.text, message.version, width
+        layout.paragraphs, layout.tops, layout.height = paragraphs, tops, height
+        self._layouts[message.key] = layout
+        self._layouts.move_to_end(message.key)
+        if len(self._layouts) > self.max_layouts:
+            self._layouts.popitem(last=False)
+        return layout
+
+
+class ConversationView(QListView):
+    """Scrolling list of messages; pages history in from the store at either end."""
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.delegate = MessageDelegate(self)
+        self.setItemDelegate(self.delegate)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.show_context_menu)
+        self._heights = {}
+        model.dataChanged.connect(self._message_changed)
+        self.verticalScrollBar().valueChanged.connect(self._page)
+
+    @property
+    def pinned_to_bottom(self):
+        scroll_bar = self.verticalScrollBar()
+        return scroll_bar.value() >= scroll_bar.maximum() - 4
+
+    def _message_changed(self, top_left, bottom_right, roles=()):
+        # Re-laying out the list asks every row for its size, so only do it when a
+        # streamed answer wraps onto a new line rather than on every chunk
+        message = self.model().rows[top_left.row()]
+        height = self.delegate.sizeHint(None, top_left).height()
+        if self._heights.get(message.key) != height:
+            self._heights = {message.key: height}
+            self.scheduleDelayedItemsLayout()
+
+    def resizeEvent(self, event):
+        # Rows rewrap to the new width; stay at the latest message if that is where the user was
+        pinned_to_bottom = self.pinned_to_bottom
+        super().resizeEvent(event)
+        if pinned_to_bottom:
+            self.scrollToBottom()
+
+    def _page(self, value):
+        scroll_bar = self.verticalScrollBar()
+        model = self.model()
+        if value == scroll_bar.minimum() and scroll_bar.maximum() > 0 and model.has_older():
+            self._keep_position(model.load_older)
+        elif value == scroll_bar.maximum() and value > 0 and model.has_newer():
+            self._keep_position(model.load_newer)
+
+    def _keep_position(self, load):
+        # Keep the row at the top of the viewport where it is while rows come and go around it
+        anchor = self.indexAt(QPoint(0, 0))
+        offset = self.visualRect(anchor).top() if anchor.isValid() else 0
+        shift = load()
+        self.doItemsLayout()
+        if anchor.isValid():
+            moved = self.model().index(anchor.row() + shift)
+            scroll_bar = self.verticalScrollBar()
+            scroll_bar.setValue(scroll_bar.value() + self.visualRect(moved).top() - offset)
+
+    def show_context_menu(self, position):
+        index = self.indexAt(position)
+        if not index.isValid():
+            return
+        menu = QMenu(self)
+        copy_action = menu.addAction("Copy Message")
+        copy_action.triggered.connect(lambda: QApplication.clipboard().setText(index.data()))
+        menu.exec(self.viewport().mapToGlobal(position))
+
+
 class OverlayWidget(QWidget):
-    def __init__(self):
+    def __init__(self, store=None):
         super().__init__()
         self.setWindowFlags(
             Qt.WindowType.FramelessWindowHint | 
@@ -197,19 +784,18 @@ class OverlayWidget(QWidget):
             Qt.WindowType.Tool
         )
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+        self._pending_chunks = []
+        self.history = ConversationModel(store if store is not None else MessageStore(core.DATA_DIR), parent=self)
         self.setup_ui()
-        self.current_response = ""
-        
-        # Create timer for reactivation
-        self.reactivation_timer = QTimer()
-        self.reactivation_timer.setSingleShot(True)
-        self.reactivation_timer.timeout.connect(self.reactivate_assistant)
 
-        # Install event filter on the application instance
-        QApplication.instance().installEventFilter(self)
+        # Coalesce streamed chunks into one document update per frame
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(FRAME_INTERVAL_MS)
+        self.render_timer.timeout.connect(self.flush_chunks)
         
     def setup_ui(self):
-        debug_print("Setting up OverlayWidget UI")
+        log.debug("Setting up OverlayWidget UI")
         # Main container
         self.container = QFrame(self)
         self.container.setObjectName("container")
@@ -234,12 +820,11 @@ class OverlayWidget(QWidget):
             #closeButton:pressed {
                 background-color: rgba(100, 255, 218, 0.2);
             }
-            QScrollArea {
+            QListView {
                 border: none;
                 background-color: transparent;
-            }
-            QScrollArea > QWidget > QWidget {
-                background-color: transparent;
+                color: #e4e4e4;
+                font-size: 14px;
             }
             QScrollBar:vertical {
                 border: none;
@@ -311,30 +896,8 @@ class OverlayWidget(QWidget):
         """)
         self.processing_label.hide()
         
-        # Create scroll area for response
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
-        
-        # Response container widget
-        self.response_container = QWidget()
-        self.response_layout = QVBoxLayout(self.response_container)
-        
-        # Response text area
-        self.response_label = QLabel()
-        self.response_label.setWordWrap(True)
-        self.response_label.setStyleSheet("""
-            color: #e4e4e4;
-            font-size: 14px;
-            line-height: 1.5;
-            padding: 10px;
-        """)
-        
-        self.response_layout.addWidget(self.response_label)
-        self.response_layout.addStretch()
-        
-        self.scroll_area.setWidget(self.response_container)
+        # One item per message; streamed chunks extend the last one
+        self.conversation_view = ConversationView(self.history)
         
         # Error label
         self.error_label = QLabel()
@@ -365,7 +928,7 @@ class OverlayWidget(QWidget):
         chat_layout.addWidget(self.send_button)
         
         self.layout.addWidget(self.processing_label)
-        self.layout.addWidget(self.scroll_area)
+        self.layout.addWidget(self.conversation_view)
         self.layout.addWidget(self.error_label)
         self.layout.addWidget(self.chat_container)
         
@@ -390,12 +953,15 @@ class OverlayWidget(QWidget):
 
     def showEvent(self, event):
         super().showEvent(event)
+        # Clicks elsewhere close the overlay; the filter sees every mouse press, so only while shown
+        QApplication.instance().installEventFilter(self)
         # Ensure the widget is properly sized when shown
         self.adjustSize()
         self.center_on_screen()
 
     def hideEvent(self, event):
         super().hideEvent(event)
+        QApplication.instance().removeEventFilter(self)
         # Clear any existing error messages when hiding
         self.error_label.hide()
         self.processing_label.hide()
@@ -407,84 +973,159 @@ class OverlayWidget(QWidget):
         self.move(center_x, center_y)
 
     def handle_close(self):
-        debug_print("Close button clicked")
-        if hasattr(self, 'parent') and hasattr(self.parent, 'toggle_assistant'):
-            self.parent.toggle_assistant()  # Deactivate
-            debug_print("Starting 3-second timer for reactivation")
-            self.reactivation_timer.start(3000)  # 3000ms = 3 seconds 
-
-    def reactivate_assistant(self):
-        debug_print("Reactivating assistant after delay")
-        if hasattr(self, 'parent') and hasattr(self.parent, 'toggle_assistant'):
-            if not self.parent.active:  # Only reactivate if currently inactive
-                self.parent.toggle_assistant()  # Reactivate
+        log.debug("Close button clicked")
+        if hasattr(self, 'parent') and hasattr(self.parent, 'pause'):
+            self.parent.pause(CLOSE_PAUSE_MS)
 
     def show(self):
         super().show()
         self.center_on_screen()
 
     def show_processing(self):
-        debug_print("Showing processing animation")
+        log.debug("Showing processing animation")
         self.error_label.hide()
+        self.processing_label.setText("Processing...")
         self.processing_label.show()
         self.processing_label.start_animation()
         
+    def show_progress(self, done, total):
+        # Large inputs are summarized part by part before the answer streams in
+        if done < total:
+            self.processing_label.setText(f"Summarized {done} of {total} parts...")
+        else:
+            self.processing_label.setText("Combining notes...")
+
     def hide_processing(self):
-        debug_print("Hiding processing animation")
+        log.debug("Hiding processing animation")
         self.processing_label.stop_animation()
         self.processing_label.hide()
     
     def show_error(self, error_message):
-        debug_print(f"Showing error: {error_message}")
+        log.debug("Showing error: %s", error_message)
         self.hide_processing()
         self.error_label.setText(error_message)
         self.error_label.show()
     
+    @property
+    def current_response(self):
+        live = self.history.live()
+        return (live.text if live is not None else '') + ''.join(self._pending_chunks)
+
+    def add_message(self, role, text):
+        """Add a finished message; an answer still streaming is kept as it stands."""
+        self.flush_chunks()
+        if len(text) > MESSAGE_PREVIEW_CHARS:
+            text = text[:MESSAGE_PREVIEW_CHARS] + "…"
+        self.history.add(role, text)
+        self.conversation_view.scrollToBottom()
+
+    def clear_response(self):
+        self.render_timer.stop()
+        self._pending_chunks = []
+        self.history.drop_live()
+
     def set_response(self, text):
-        debug_print("Setting response text")
-        self.current_response = text
-        self.response_label.setText(text)
+        log.debug("Setting response text")
+        self.flush_chunks()
+        # The streamed chunks usually add up to the final text already
+        pinned_to_bottom = self.conversation_view.pinned_to_bottom
+        self.history.finish_live(text)
+        if pinned_to_bottom:
+            self.conversation_view.scrollToBottom()
     
     def append_chunk(self, chunk):
-        debug_print(f"Appending chunk: {chunk[:50]}...")
-        self.current_response += chunk
-        self.response_label.setText(self.current_response)
+        log.debug("Appending chunk: %.50s...", chunk)
+        self._pending_chunks.append(chunk)
+        if not self.render_timer.isActive():
+            self.render_timer.start()
+
+    def flush_chunks(self):
+        if not self._pending_chunks:
+            return
+        text = ''.join(self._pending_chunks)
+        self._pending_chunks = []
+
+        pinned_to_bottom = self.conversation_view.pinned_to_bottom
+        self.history.append_live(text)
+        if pinned_to_bottom:
+            self.conversation_view.scrollToBottom()
 
     def send_message(self):
         message = self.chat_input.text().strip()
         if message:
             self.chat_input.clear()
-            # Update the conversation context
-            full_context = f"{self.current_response}\n\nUser: {message}"
-            # Process the new message with context
-            self.process_new_message(full_context)
+            self.process_new_message(message)
 
     def process_new_message(self, message):
         self.show_processing()
-        # Emit a signal to the main window to process the message
-        if hasattr(self, 'parent') and hasattr(self.parent, 'process_text'):
-            self.parent.process_text(message)
+        # Ask the main window to continue the conversation with this message
+        if hasattr(self, 'parent') and hasattr(self.parent, 'send_followup'):
+            self.parent.send_followup(message)
 
 class AIAssistant(QMainWindow):
+    model_warmed = pyqtSignal(bool, float, str)
+    queue_answered = pyqtSignal(int)
+
     def __init__(self):
         super().__init__()
         self.active = True
+        self.idle = False
+        self.model_status = ""
+        self.conversation = None
         self.text_processor = None
+        # Class of an answer asked for but not started yet (see process_text)
+        self.pending_priority = None
+        # (copied, text, trace, quick) of a copy waiting for a chat answer to finish (see handle_input)
+        self.deferred_copy = None
+        self.retired_processors = set()
+        self.cancel_latencies = deque(maxlen=100)
+        self.response_cache = ResponseCache()
+        self.semantic_cache = SemanticCache()
+        self.connectivity = ConnectivityMonitor()
+        self.connectivity.start()
+        self.engine = BackendEngine()
+        self.engine.tiers = TierPolicy.from_file(core.DATA_DIR / "model_tiers.json")
+        self.engine.scheduler = PriorityScheduler.from_file(core.DATA_DIR / "scheduler.json")
+        self.engine.start()
+        # Texts copied while no model was reachable are answered once one is
+        self.request_queue = RequestQueue()
+        self.queue_drainer = QueueDrainer(self.request_queue, self.engine, use_gemini=True, cache=self.response_cache,
+                                          connectivity=self.connectivity, on_answered=self.queue_answered.emit)
+        self.queue_drainer.start()
+        self.queue_answered.connect(self.handle_queue_answered)
+        self.input_pipeline = InputPipeline(parent=self)
+        self.input_pipeline.text_ready.connect(self.handle_input)
+        self.input_filter = InputFilter.from_file(core.DATA_DIR / "input_filter.json")
+        # Where the platform has a primary selection (X11, Wayland), selecting text
+        # prefetches its answer and copying it shows the answer
+        self.speculative = QApplication.clipboard().supportsSelection()
+        self.prefetcher = Prefetcher(self.create_processor, self.retire_processor, parent=self)
+        self.selection_pipeline = InputPipeline(debounce_ms=SELECTION_STABLE_MS, parent=self)
+        self.selection_pipeline.text_ready.connect(self.handle_selection)
         
-        # Then create overlay and setup other components
-        self.overlay = OverlayWidget()
-        self.overlay.parent = self
+        # The overlay is built on first use and released again while the assistant is idle
+        self.history_store = MessageStore(core.DATA_DIR)
+        self._overlay = None
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(IDLE_RELEASE_MS)
+        self.idle_timer.timeout.connect(self.release_resources)
+        self.reactivation_timer = QTimer(self)
+        self.reactivation_timer.setSingleShot(True)
+        self.reactivation_timer.timeout.connect(self.reactivate_assistant)
         self.setup_tray()
         self.setup_clipboard_monitor()
+        self.model_warmed.connect(self.handle_model_warmed)
+        self.warm_model()
 
     def setup_tray(self):
         self.tray_icon = QSystemTrayIcon(self)
         icon_path = str(Path(__file__).parent / "icon.png")
         if Path(icon_path).exists():
             self.tray_icon.setIcon(QIcon(icon_path))
-            debug_print("Tray icon loaded successfully")
+            log.debug("Tray icon loaded successfully")
         else:
-            debug_print("Warning: icon.png not found in the application directory")
+            log.warning("icon.png not found in the application directory")
         
         tray_menu = QMenu()
 
@@ -499,6 +1140,18 @@ class AIAssistant(QMainWindow):
         
         # Add separator for visual clarity
         tray_menu.addSeparator()
+
+        if QApplication.clipboard().supportsSelection():
+            prefetch_action = tray_menu.addAction("Prefetch Selections")
+            prefetch_action.setCheckable(True)
+            prefetch_action.setChecked(self.speculative)
+            prefetch_action.toggled.connect(self.set_speculative)
+
+        self.offline_menu = tray_menu.addMenu("Offline Answers")
+        self.offline_menu.aboutToShow.connect(self.populate_offline_menu)
+
+        diagnostics_action = tray_menu.addAction("Export Diagnostics")
+        diagnostics_action.triggered.connect(self.export_diagnostics)
         
         exit_action = tray_menu.addAction("Exit")
         exit_action.triggered.connect(self.cleanup_and_exit)
@@ -509,12 +1162,32 @@ class AIAssistant(QMainWindow):
 
 
 
+    @property
+    def overlay(self):
+        if self._overlay is None:
+            started = time.perf_counter()
+            self._overlay = OverlayWidget(self.history_store)
+            self._overlay.parent = self
+            metrics.observe("overlay.build", time.perf_counter() - started)
+        return self._overlay
+
     def setup_clipboard_monitor(self):
-        debug_print("Setting up clipboard monitor")
+        log.debug("Setting up clipboard monitor")
         self.clipboard = QApplication.clipboard()
+        self.connect_clipboard()
+        keyboard.add_hotkey('ctrl+shift+space', self.toggle_assistant)
+
+    def connect_clipboard(self):
         self.clipboard.dataChanged.connect(self.handle_clipboard_change)
         self.clipboard.selectionChanged.connect(self.handle_selection_change)
-        keyboard.add_hotkey('ctrl+shift+space', self.toggle_assistant)
+
+    def disconnect_clipboard(self):
+        for signal, handler in ((self.clipboard.dataChanged, self.handle_clipboard_change),
+                                (self.clipboard.selectionChanged, self.handle_selection_change)):
+            try:
+                signal.disconnect(handler)
+            except TypeError:
+                pass
 
     def handle_selection_change(self):
         if not self.active:
@@ -522,8 +1195,9 @@ class AIAssistant(QMainWindow):
             
         text = self.clipboard.text(mode=QApplication.clipboard().Selection)
         if text and text.strip():
-            debug_print(f"Selection changed: {text[:50]}...")
-            self.process_text(text)
+            log.debug("Selection changed: %.50s...", text)
+            pipeline = self.selection_pipeline if self.speculative else self.input_pipeline
+            pipeline.submit(text, "selection")
 
     def handle_clipboard_change(self):
         if not self.active:
@@ -531,65 +1205,414 @@ class AIAssistant(QMainWindow):
             
         text = self.clipboard.text()
         if text and text.strip():
-            debug_print(f"Clipboard changed: {text[:50]}...")
-            self.process_text(text)
+            log.debug("Clipboard changed: %.50s...", text)
+            self.input_pipeline.submit(text, "clipboard")
+
+    def handle_input(self, text, source, trace):
+        if not self.active:
+            trace.finish("inactive")
+            return
+        copied = text
+        action, category, text = self.input_filter.check(text)
+        if action == DROP:
+            # The answer on screen, if any, stays: nothing worth replacing it with was copied
+            log.info("Skipping %s text (%d skipped so far)", category, self.input_filter.stats()['skipped'])
+            trace.finish("filtered", category=category)
+            return
+        trace.mark("filtered", category=category, action=action)
+        # Selecting text is not asking for an answer: it never replaces one that was asked for
+        priority = SPECULATIVE if source == "selection" else COPY
+        if self.answer_in_progress(priority):
+            if priority == SPECULATIVE:
+                trace.finish("busy")
+                return
+            # A copy made while a follow-up is answered is asked once that answer is done
+            # A prefetched answer for it stays with the prefetcher until then
+            if self.deferred_copy is not None:
+                self.deferred_copy[2].finish("superseded")
+            log.info("Holding copied text until the chat answer finishes")
+            trace.mark("deferred")
+            self.deferred_copy = (copied, text, trace, action == QUICK)
+            return
+        if priority == COPY:
+            self.answer_copy(copied, text, trace, action == QUICK)
+        else:
+            self.process_text(text, trace, quick=action == QUICK, priority=priority, source=source)
+
+    def answer_copy(self, copied, text, trace, quick):
+        """Show the prefetched answer for a copied text if there is one, else ask for it."""
+        if self.speculative:
+            speculation = self.prefetcher.take(copied)
+            if speculation is not None:
+                self.promote(speculation, trace)
+                return
+        self.process_text(text, trace, quick=quick)
+
+    def handle_selection(self, text, source, trace):
+        if not self.active:
+            trace.finish("inactive")
+            return
+        if len(text) > core.LARGE_INPUT_CHARS:
+            trace.finish("too_large")
+            return
+        # Selecting and then copying is already being answered: no need to ask twice
+        if self.input_pipeline.dispatched_recently(text):
+            trace.finish("answered")
+            return
+        action, category, filtered = self.input_filter.check(text)
+        if action == DROP:
+            trace.finish("filtered", category=category)
+            return
+        if self.conversation is not None and Prefetcher.key(self.conversation.text) == Prefetcher.key(filtered):
+            trace.finish("answered")
+            return
+        self.prefetcher.prefetch(text, Conversation(filtered, quick=action == QUICK), trace)
+
+    def promote(self, speculation, trace):
+        """Show a prefetched answer for the text just copied, finished or still streaming."""
+        trace.finish("prefetched", streaming=not speculation.done)
+        self.stop_processing()
+        self.conversation = speculation.conversation
+        self.overlay.add_message("user", speculation.conversation.text)
+        self.overlay.show()
+        self.overlay.clear_response()
+        if speculation.done:
+            self.overlay.hide_processing()
+            self.overlay.set_response(speculation.response)
+            self.conversation.add_assistant(speculation.response)
+            return
+        self.overlay.show_processing()
+        self.overlay.append_chunk("".join(speculation.chunks))
+        # Now that it is on screen, only a follow-up may take its backend slot
+        speculation.processor.raise_priority(COPY)
+        self.text_processor = speculation.processor
+        speculation.forward(self.overlay.append_chunk, self.handle_response, self.handle_error)
+
+    def set_speculative(self, enabled):
+        self.speculative = enabled
+        if not enabled:
+            self.selection_pipeline.clear()
+            self.prefetcher.clear()
+
+    def answer_in_progress(self, priority):
+        """True while an answer of a more urgent class than ``priority`` is pending or streaming."""
+        if self.text_processor is not None and not self.text_processor.isFinished():
+            current = self.text_processor.priority
+        elif self.pending_priority is not None:
+            current = self.pending_priority
+        else:
+            return False
+        return PRIORITY_CLASSES.index(current) < PRIORITY_CLASSES.index(priority)
+
+    def run_deferred_copy(self):
+        """Answer the copy held back by a chat answer once no chat answer is pending or streaming."""
+        if self.deferred_copy is None or self.answer_in_progress(COPY):
+            return
+        copied, text, trace, quick = self.deferred_copy
+        self.deferred_copy = None
+        if not self.active:
+            trace.finish("inactive")
+            return
+        self.answer_copy(copied, text, trace, quick)
+
+    def clear_deferred_copy(self):
+        if self.deferred_copy is not None:
+            self.deferred_copy[2].finish("cleared")
+            self.deferred_copy = None
 
-    def process_text(self, text):
+    def process_text(self, text, trace=None, quick=False, priority=COPY, source="clipboard"):
+        # Newly copied text starts a new conversation
+        conversation = Conversation(text, quick=quick)
+        self.conversation = conversation
+        # The previous answer stops here rather than streaming on under the new text
+        self.stop_processing()
+        self.overlay.add_message("user", text)
         self.overlay.show()
         self.overlay.show_processing()
-        QTimer.singleShot(100, lambda: self.start_processing(text))
+        self.pending_priority = priority
+        QTimer.singleShot(100, lambda: self.start_processing(conversation, trace, priority, source))
 
-    def start_processing(self, text):
-        # Stop any existing text processor
-        if self.text_processor is not None:
-            self.text_processor.stop()
-            self.text_processor.deleteLater()
-        
-        self.text_processor = TextProcessor(text, use_gemini=True)
+    def send_followup(self, message):
+        trace = tracer.start("followup", chars=len(message))
+        if self.conversation is None:
+            self.process_text(message, trace, priority=CHAT, source="followup")
+            return
+        # A follow-up sent mid-stream keeps the partial answer as that turn's reply
+        if self.text_processor is not None and self.text_processor.conversation is self.conversation:
+            partial = self.overlay.current_response
+            if partial:
+                self.conversation.add_assistant(partial)
+        self.conversation.add_user(message)
+        self.stop_processing()
+        self.overlay.add_message("user", message)
+        conversation = self.conversation
+        self.overlay.show_processing()
+        self.pending_priority = CHAT
+        QTimer.singleShot(100, lambda: self.start_processing(conversation, trace, CHAT, "followup"))
+
+    def start_processing(self, conversation, trace=None, priority=COPY, source="clipboard"):
+        self.stop_processing()
+        self.pending_priority = None
+
+        # Prefetches keep running; the scheduler preempts them if this answer needs their backend slot
+        self.overlay.clear_response()
+        self.text_processor = self.create_processor(conversation, trace, priority=priority, source=source)
         self.text_processor.chunk_ready.connect(self.overlay.append_chunk)
         self.text_processor.result_ready.connect(self.handle_response)
         self.text_processor.error_occurred.connect(self.handle_error)
+        self.text_processor.progress.connect(self.overlay.show_progress)
+        self.text_processor.queued.connect(self.handle_queued)
+        # Not disconnected on retiring: a copy waits for whichever answer finishes last
+        self.text_processor.finished.connect(self.run_deferred_copy)
         self.text_processor.start()
 
+    def stop_processing(self):
+        # Cancel the current text processor without waiting for it
+        if self.text_processor is not None:
+            self.text_processor.stop()
+            self.retire_processor(self.text_processor)
+            self.text_processor = None
+
+    def create_processor(self, conversation, trace=None, hedge=True, queue=True, priority=COPY, source="clipboard"):
+        return TextProcessor(conversation, self.engine, use_gemini=True, cache=self.response_cache,
+                             connectivity=self.connectivity, trace=trace, semantic_cache=self.semantic_cache,
+                             hedge=hedge, queue=self.request_queue if queue else None,
+                             latency_budget=LATENCY_BUDGET_SECONDS, priority=priority, source=source)
+
+    def retire_processor(self, processor):
+        """Detach a processor from the overlay and reap it once its task finishes."""
+        for signal in (processor.chunk_ready, processor.result_ready, processor.error_occurred, processor.progress,
+                       processor.queued):
+            try:
+                signal.disconnect()
+            except TypeError:
+                pass
+        self.retired_processors.add(processor)
+        processor.finished.connect(lambda: self.reap_processor(processor))
+        if processor.isFinished():
+            self.reap_processor(processor)
+
+    def reap_processor(self, processor):
+        if processor not in self.retired_processors:
+            return
+        self.retired_processors.discard(processor)
+        if processor.cancel_requested_at is not None and processor.stopped_at is not None:
+            latency = max(0.0, processor.stopped_at - processor.cancel_requested_at)
+            self.cancel_latencies.append(latency)
+            average = sum(self.cancel_latencies) / len(self.cancel_latencies)
+            log.info("Cancelled processor idle after %.0f ms (average %.0f ms over %d)",
+                     latency * 1000, average * 1000, len(self.cancel_latencies))
+        processor.deleteLater()
+
+    def warm_model(self):
+        log.info("Warming the Ollama tier models")
+        self.set_model_status("Loading model...")
+        future = self.engine.submit(self.engine.warm_tiers())
+        future.add_done_callback(self._model_warm_done)
+
+    def _model_warm_done(self, future):
+        # Runs on the engine thread; the signal hands the outcome to the GUI thread
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.model_warmed.emit(False, 0.0, str(error))
+        else:
+            self.model_warmed.emit(True, future.result(), "")
+
+    def handle_model_warmed(self, ready, seconds, error):
+        if ready:
+            log.info("%s ready after %.0f ms warmup", ", ".join(self.engine.ollama_models), seconds * 1000)
+            self.set_model_status("Model ready")
+            self.wake_queue()
+        else:
+            log.warning("Model warmup failed: %s", error)
+            self.set_model_status("Model unavailable")
+
+    def set_model_status(self, status):
+        self.model_status = status
+        self.status_indicator.set_detail(status)
+        self.update_tray_tooltip()
+
     def handle_error(self, error_message):
-        debug_print(f"Error handled: {error_message}")
+        log.error("Error handled: %s", error_message)
         self.overlay.show_error(error_message)
 
     def toggle_assistant(self):
         self.active = not self.active
-        debug_print(f"Assistant toggled: {'active' if self.active else 'inactive'}")
+        log.info("Assistant toggled: %s", 'active' if self.active else 'inactive')
+        self.reactivation_timer.stop()
         self.status_indicator.update_status(self.active)
         self.update_tray_tooltip()
         if not self.active:
-            self.overlay.hide()
+            self.disconnect_clipboard()
+            self.input_pipeline.clear()
+            self.selection_pipeline.clear()
+            self.prefetcher.clear()
+            self.clear_deferred_copy()
+            # Nothing is answered while the assistant is off, queued texts included
+            self.queue_drainer.stop()
+            if self._overlay is not None:
+                self._overlay.hide()
+            # A short pause (closing the overlay) should not cost a model reload
+            self.idle_timer.start()
+        else:
+            self.idle_timer.stop()
+            self.connect_clipboard()
+            self.queue_drainer.start()
+            if self.idle:
+                self.idle = False
+                log.info("Leaving idle mode")
+            self.warm_model()
+
+    def pause(self, duration_ms):
+        """Turn the assistant off for ``duration_ms``."""
+        if self.active:
+            self.toggle_assistant()
+        log.debug("Reactivating in %d ms", duration_ms)
+        self.reactivation_timer.start(duration_ms)
+
+    def reactivate_assistant(self):
+        log.info("Reactivating assistant after delay")
+        if not self.active:
+            self.toggle_assistant()
+
+    def release_resources(self):
+        """Idle mode: drop the overlay, the semantic index and the loaded model until they are needed."""
+        if self.active:
+            return
+        log.info("Entering idle mode: releasing the overlay and unloading %s", ", ".join(self.engine.ollama_models))
+        self.idle = True
+        self.stop_processing()
+        if self._overlay is not None:
+            # Its widgets, stylesheets and cached text layouts go with it; the history stays on disk
+            self._overlay.hide()
+            self._overlay.deleteLater()
+            self._overlay = None
+        self.semantic_cache.release()
+        future = self.engine.submit(self.engine.release())
+        future.add_done_callback(self._model_released)
+        self.set_model_status("Idle")
+
+    def _model_released(self, future):
+        # Runs on the engine thread
+        if not future.cancelled() and future.exception() is not None:
+            log.warning("Model unload failed: %s", future.exception())
 
     def update_tray_tooltip(self):
-        self.tray_icon.setToolTip(f"Sparkience: {'Active' if self.active else 'Inactive'}")
+        tooltip = f"Sparkience: {'Active' if self.active else 'Inactive'}"
+        if self.model_status:
+            tooltip += f" - {self.model_status}"
+        self.tray_icon.setToolTip(tooltip)
 
 
     def handle_response(self, response):
-        debug_print("Response received and processing complete")
+        log.info("Response received and processing complete")
         self.overlay.hide_processing()
         if response:
             self.overlay.set_response(response)
+            if self.text_processor is not None:
+                self.text_processor.conversation.add_assistant(response)
+            self.wake_queue()
         
         # Cleanup the text processor after response is handled
         if self.text_processor is not None:
-            self.text_processor.stop()
-            self.text_processor.deleteLater()
+            self.retire_processor(self.text_processor)
             self.text_processor = None
 
-    def cleanup_and_exit(self):
-        debug_print("Cleaning up and exiting")
-        # Stop the text processor if it exists
+    def handle_queued(self):
+        self.overlay.hide_processing()
+        self.overlay.show_error("No AI model is reachable. Saved for later: see Offline Answers in the tray menu.")
+        self.queue_drainer.wake(self.queue_drainer.min_backoff)
         if self.text_processor is not None:
-            self.text_processor.stop()
-            self.text_processor.deleteLater()
+            self.retire_processor(self.text_processor)
+            self.text_processor = None
+
+    def wake_queue(self):
+        # A model just answered, so queued requests can be answered too
+        if self.active and self.request_queue.depth():
+            self.queue_drainer.wake()
+
+    def handle_queue_answered(self, count):
+        self.tray_icon.showMessage("Sparkience", f"{count} saved {'text was' if count == 1 else 'texts were'} "
+                                   "answered. Find them under Offline Answers in the tray menu.")
+
+    def populate_offline_menu(self):
+        # Built each time the menu opens, so it always shows the latest answers
+        self.offline_menu.clear()
+        waiting = self.request_queue.depth()
+        if waiting:
+            self.offline_menu.addAction(f"{waiting} waiting for a model").setEnabled(False)
+        results = self.request_queue.results()
+        for key, text, quick, response, answered_at in results:
+            title = " ".join(text.split())
+            action = self.offline_menu.addAction(title[:48] + "…" if len(title) > 48 else title)
+            action.triggered.connect(lambda checked=False, text=text, quick=quick, response=response:
+                                     self.show_offline_answer(text, quick, response))
+        if not waiting and not results:
+            self.offline_menu.addAction("No saved answers").setEnabled(False)
+        if results:
+            self.offline_menu.addSeparator()
+            self.offline_menu.addAction("Clear Answers").triggered.connect(self.request_queue.clear_answers)
+
+    def show_offline_answer(self, text, quick, response):
+        """Open a queued text and its answer in the overlay as a conversation to follow up on."""
+        self.stop_processing()
+        self.conversation = Conversation(text, quick=quick)
+        self.conversation.add_assistant(response)
+        self.overlay.add_message("user", text)
+        self.overlay.clear_response()
+        self.overlay.hide_processing()
+        self.overlay.set_response(response)
+        self.overlay.show()
+
+    def diagnostics(self):
+        return {
+            'input_pipeline': self.input_pipeline.stats(),
+            'input_filter': self.input_filter.stats(),
+            'prefetch': self.prefetcher.stats(),
+            'first_token': self.engine.first_token_stats(),
+            'model_load': self.engine.model_load_stats(),
+            'routing': self.engine.router.snapshot(),
+            'tiers': self.engine.tiers.snapshot(),
+            'scheduler': self.engine.scheduler.stats(),
+            'response_cache': self.response_cache.stats(),
+            'semantic_cache': self.semantic_cache.stats(),
+            'offline_queue': {**self.request_queue.stats(), **self.queue_drainer.stats()},
+        }
+
+    def export_diagnostics(self):
+        try:
+            path = export_diagnostics(core.DATA_DIR / "diagnostics.json", self.diagnostics())
+        except OSError as e:
+            log.warning("Diagnostics export failed: %s", e)
+            self.tray_icon.showMessage("Sparkience", f"Could not export diagnostics: {e}")
+            return
+        log.info("Diagnostics written to %s", path)
+        self.tray_icon.showMessage("Sparkience", f"Diagnostics saved to {path}")
+
+    def cleanup_and_exit(self):
+        log.info("Cleaning up and exiting")
+        self.stop_processing()
+        self.prefetcher.clear()
+        for processor in list(self.retired_processors):
+            processor.stop()
+            processor.wait(2000)  # Requests must not outlive the application
+        self.queue_drainer.stop()
+        self.engine.stop()
         
+        for name, stats in self.diagnostics().items():
+            log.info("%s: %s", name, stats)
+        self.response_cache.close()
+        self.semantic_cache.close()
+        self.request_queue.close()
+        self.history_store.close()
+        self.connectivity.stop()
         keyboard.unhook_all()
         QApplication.quit()
 
 if __name__ == "__main__":
+    configure_logging()
     app = QApplication(sys.argv)
     
     # Set application-wide stylesheet
@@ -600,6 +1623,6 @@ if __name__ == "__main__":
     """)
     
     assistant = AIAssistant()
-    debug_print("Application started")
+    log.info("Application started")
     sys.exit(app.exec())
 
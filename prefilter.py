@@ -0,0 +1,289 @@
+"""Cheap local checks that decide whether copied text is worth a model call.
+
+``InputFilter.check`` sorts a copied text into a category with a few regular
+expressions and counts over at most ``SAMPLE_CHARS`` characters, so even a
+multi-megabyte copy is classified in well under a millisecond. Each category
+maps to an action:
+
+- ``drop``: not sent at all (URLs, paths, numbers, hashes, base64 blobs,
+  binary data, and anything that looks like a password, key or token)
+- ``quick``: a short answer with a capped token budget (single words, short phrases)
+- ``full``: the normal answer
+
+Independently of the action, text longer than the category's ``max_chars`` is
+cut down before it is sent. Both limits are well above the size at which the
+core summarizes a text part by part (``core.LARGE_INPUT_CHARS``), so a large
+log reaches the model whole, error at the end included; only the head of a
+bigger dump is sent. Whatever is left to send is scanned for secrets in
+full, not just the sample.
+
+Rules can be overridden in ``~/.sparkience/input_filter.json``:
+
+    {"rules": {"url": "quick", "phrase": "full"}, "max_chars": {"structured": 50000}}
+"""
+import re
+import json
+import math
+from collections import Counter
+
+from tracing import log, metrics
+
+DROP = "drop"
+QUICK = "quick"
+FULL = "full"
+ACTIONS = (DROP, QUICK, FULL)
+
+DEFAULT_RULES = {
+    'too_short': DROP,
+    'binary': DROP,
+    'secret': DROP,
+    'blob': DROP,
+    'url': DROP,
+    'email': DROP,
+    'path': DROP,
+    'number': DROP,
+    'word': QUICK,
+    'phrase': QUICK,
+    'structured': FULL,
+    'text': FULL,
+}
+
+# Longer texts are truncated to this many characters before being sent. Logs and dumps are
+# the large copies, and their error is often at the end: up to ~50 summarized parts of them go
+DEFAULT_MAX_CHARS = {
+    'structured': 200000,
+    'text': 40000,
+}
+
+# Classification only ever looks at this much of the text
+SAMPLE_CHARS = 16384
+
+# Substrings every secret pattern contains; the regex only runs on text that has one
+SECRET_MARKERS = ("PRIVATE KEY-----", "ghp_", "gho_", "ghu_", "ghs_", "ghr_", "github_pat_", "sk-", "xox",
+                  "AKIA", "AIza", "eyJ")
+SECRET_KEYWORDS = ("passw", "secret", "key", "token")
+# Each alternative starts with its marker and checks the word boundary behind it, so the regex
+# skips ahead to a marker instead of trying every alternative at every position
+SECRET_PATTERNS = re.compile(
+    r"-----BEGIN (?:[A-Z]+ )*PRIVATE KEY-----"
+    r"|gh[pousr]_(?<!\wgh._)[A-Za-z0-9]{36}\b"
+    r"|github_pat_(?<!\wgithub_pat_)[A-Za-z0-9_]{60,}"
+    r"|sk-(?<!\wsk-)(?:proj-|ant-)?[A-Za-z0-9_-]{20,}"
+    r"|xox(?<!\wxox)[abprs]-[A-Za-z0-9-]{10,}"
+    r"|AKIA(?<!\wAKIA)[0-9A-Z]{16}\b"
+    r"|AIza(?<!\wAIza)[0-9A-Za-z_-]{35}"
+    r"|eyJ(?<!\weyJ)[A-Za-z0-9_-]{10,}\.eyJ[A-Za-z0-9_-]{10,}\.[A-Za-z0-9_-]{10,}"
+)
+# password = ..., "api_key": ... in lowercased text; whether the value is a credential is up to
+# looks_like_credential. Searched without re.IGNORECASE, which would disable skipping ahead.
+SECRET_ASSIGNMENT_PATTERN = re.compile(
+    r"(?:password|passwd|secret|api[_-]?key|token)[\"']?\s*[:=]\s*(\"[^\"\n]*\"|'[^'\n]*'|[^\s,;]+)")
+# Values that fetch a secret rather than spell it out: calls, subscripts, attribute access
+CODE_VALUE_PATTERN = re.compile(r"[A-Za-z_][\w.]*[(\[]|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)+$")
+URL_PATTERN = re.compile(r"(?:[a-z][a-z0-9+.-]*://|www\.)\S+$", re.IGNORECASE)
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s]+\.[a-z]{2,}$", re.IGNORECASE)
+PATH_PATTERN = re.compile(r"(?:~|\.{1,2})?[/\\]\S*$|[a-z]:[/\\]\S*$|\S+[/\\]\S+\.[a-z0-9]{1,5}$", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"[-+(]?[\d.,:/%$€£()\s-]*\d[\d.,:/%$€£()\s-]*$")
+BLOB_PATTERN = re.compile(r"[A-Za-z0-9+/=_-]{32,}$")
+HEX_PATTERN = re.compile(r"(?:0x)?[0-9a-f]{16,}$", re.IGNORECASE)
+# Words of an identifier (camelCase, snake_case, acronyms) and code such as Map<String,Int> or f(1);g[2]
+IDENTIFIER_PART_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+CODE_TOKEN_PATTERN = re.compile(r"[A-Za-z_]\w*(?:\(.*\)|\[.*\]|<.*>|\{.*\})")
+CONTROL_PATTERN = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f�]")
+PASSWORD_SYMBOLS = set("!\"#$%&'()*+,;<=>?@[\\]^`{|}~")
+
+
+def entropy(text):
+    """Shannon entropy of ``text`` in bits per character."""
+    counts = Counter(text)
+    total = len(text)
+    return -sum(count / total * math.log2(count / total) for count in counts.values())
+
+
+def contains_secret(text):
+    if any(marker in text for marker in SECRET_MARKERS) and SECRET_PATTERNS.search(text) is not None:
+        return True
+    lowered = text.lower()
+    if not any(keyword in lowered for keyword in SECRET_KEYWORDS):
+        return False
+    # Values keep their case unless lowercasing changed the length (such as for İ) and offsets moved
+    original = text if len(lowered) == len(text) else lowered
+    for match in SECRET_ASSIGNMENT_PATTERN.finditer(lowered):
+        before = lowered[match.start() - 1] if match.start() else " "
+        if before.isalnum() or before == "_":
+            continue  # part of a longer name, such as mytoken
+        if looks_like_credential(original[match.start(1):match.end(1)]):
+            return True
+    return False
+
+
+def looks_like_credential(value):
+    """True for a literal secret assigned in code or config, False for code that looks one up."""
+    if value[:1] in "\"'":
+        # Quoted: a literal unless it is prose or a placeholder such as "<password>" or "${TOKEN}"
+        literal = value[1:-1]
+        return len(literal) >= 8 and not any(c.isspace() for c in literal) and literal[:1] not in "$<{%"
+    if len(value) < 8 or CODE_VALUE_PATTERN.match(value) or any(c in "\"'{}$<" for c in value):
+        return False
+    return not looks_like_identifier(value)
+
+
+def looks_like_identifier(token):
+    # Random strings split into runs of one or two characters and carry plenty of digits
+    parts = IDENTIFIER_PART_PATTERN.findall(token)
+    if not parts:
+        return False
+    return sum(map(len, parts)) / len(parts) >= 3 and sum(c.isdigit() for c in token) <= 2
+
+
+def looks_like_blob(token):
+    """Base64, keys and other encoded data; long identifiers are words, not noise."""
+    if HEX_PATTERN.match(token):
+        return True
+    return BLOB_PATTERN.match(token) is not None and entropy(token) >= 4.0 and not looks_like_identifier(token)
+
+
+def looks_like_password(token):
+    # Generated passwords mix every character class and rarely repeat one
+    if not 8 <= len(token) <= 64 or not any(c in PASSWORD_SYMBOLS for c in token):
+        return False
+    # Generic types and chained calls have all of that too, but their brackets pair up around a name
+    if CODE_TOKEN_PATTERN.search(token):
+        return False
+    if not (any(c.islower() for c in token) and any(c.isupper() for c in token) and any(c.isdigit() for c in token)):
+        return False
+    return entropy(token) >= 0.85 * math.log2(len(token))
+
+
+def is_structured(sample):
+    """True for JSON, and for CSV/TSV or log output whose lines share one shape."""
+    stripped = sample.lstrip()
+    if stripped[:1] in "{[":
+        try:
+            json.loads(sample)
+            return True
+        except ValueError:
+            # A truncated sample of a large document will not parse; judge by its punctuation
+            if stripped.count('":') >= 3 or stripped.count("},") >= 3:
+                return True
+    lines = [line for line in sample.splitlines()[:50] if line.strip()]
+    if len(lines) < 4:
+        return False
+    for delimiter in (",", "\t", ";", "|"):
+        counts = Counter(line.count(delimiter) for line in lines)
+        columns, matching = counts.most_common(1)[0]
+        if columns >= 2 and matching >= 0.8 * len(lines):
+            return True
+    # Logs: most lines start with a timestamp or a level
+    stamped = sum(1 for line in lines if re.match(r"\s*(?:\[?\d{2,4}[-/:]\d{2}|\[?(?:DEBUG|INFO|WARN|ERROR)\b)", line))
+    return stamped >= 0.8 * len(lines)
+
+
+class InputFilter:
+    """Classifies copied text and applies the configured action and truncation.
+
+    ``check`` returns (action, category, text), where ``text`` may have been
+    truncated. Counts per category and action are kept for ``stats`` and
+    mirrored into the ``input_filter.<action>`` metrics.
+    """
+
+    def __init__(self, rules=None, max_chars=None, min_chars=3, quick_words=3):
+        self.rules = {**DEFAULT_RULES, **(rules or {})}
+        self.max_chars = {**DEFAULT_MAX_CHARS, **(max_chars or {})}
+        self.min_chars = min_chars
+        self.quick_words = quick_words
+        self.checked = 0
+        self.truncated = 0
+        self.actions = Counter()
+        self.categories = Counter()
+
+    @classmethod
+    def from_file(cls, path):
+        """Load rule overrides from a JSON file; defaults are used if it is missing or invalid."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+            configured_rules = dict(config.get('rules') or {})
+            max_chars = {category: int(limit) for category, limit in (config.get('max_chars') or {}).items()}
+            min_chars = int(config.get('min_chars', 3))
+            quick_words = int(config.get('quick_words', 3))
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            log.warning("Ignoring input filter config %s: %s", path, e)
+            return cls()
+        rules = {}
+        for category, action in configured_rules.items():
+            if category not in DEFAULT_RULES or action not in ACTIONS:
+                log.warning("Ignoring input filter rule %s: %s", category, action)
+                continue
+            rules[category] = action
+        return cls(rules, max_chars, min_chars, quick_words)
+
+    def classify(self, text):
+        sample = text[:SAMPLE_CHARS].strip()
+        if len(sample) < self.min_chars:
+            return 'too_short'
+        if len(CONTROL_PATTERN.findall(sample)) > 0.01 * len(sample):
+            return 'binary'
+        if contains_secret(sample):
+            return 'secret'
+        if not any(c.isspace() for c in sample):
+            return self._classify_token(sample)
+        if NUMBER_PATTERN.match(sample):
+            return 'number'
+        if is_structured(sample):
+            return 'structured'
+        if len(sample) < 40 and len(sample.split()) <= self.quick_words:
+            return 'phrase'
+        return 'text'
+
+    def _classify_token(self, token):
+        if URL_PATTERN.match(token):
+            return 'url'
+        if EMAIL_PATTERN.match(token):
+            return 'email'
+        if PATH_PATTERN.match(token):
+            return 'path'
+        if NUMBER_PATTERN.match(token):
+            return 'number'
+        if looks_like_password(token):
+            return 'secret'
+        if looks_like_blob(token):
+            return 'blob'
+        return 'word'
+
+    def check(self, text):
+        category = self.classify(text)
+        action = self.rules.get(category, FULL)
+        limit = self.max_chars.get(category)
+        if action != DROP and limit is not None and len(text) > limit:
+            text = self.truncate(text, limit)
+            self.truncated += 1
+        # Whatever is actually sent must not carry a secret from past the sample
+        if action != DROP and len(text) > SAMPLE_CHARS and contains_secret(text):
+            category, action = 'secret', self.rules['secret']
+        self.checked += 1
+        self.actions[action] += 1
+        self.categories[category] += 1
+        metrics.incr(f"input_filter.{action}")
+        log.debug("Input filter: %s -> %s", category, action)
+        return action, category, text
+
+    @staticmethod
+    def truncate(text, limit):
+        # Cut at the last line break before the limit so no row or sentence is split
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        return f"{text[:cut]}\n[... {len(text) - cut} more characters not shown]"
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'skipped': self.actions[DROP],
+            'quick': self.actions[QUICK],
+            'full': self.actions[FULL],
+            'truncated': self.truncated,
+            'categories': dict(self.categories),
+        }
@@ -0,0 +1,213 @@
+"""Leveled logging, request traces and metrics for Sparkle AI.
+
+Logging goes through the standard ``logging`` module under the ``sparkle``
+logger. A disabled level costs one cached level check as long as messages are
+passed as %-style arguments rather than pre-formatted f-strings, which matters
+on per-chunk paths:
+
+    log.debug("Appending chunk: %.50s", chunk)
+
+``configure_logging`` sends records to stdout at ``SPARKLE_LOG_LEVEL``
+(INFO by default). Without it nothing is printed, which suits headless use.
+
+Each request carries a ``Trace`` marking its stages (event received, dispatched,
+backend chosen, first token, done/cancelled/error); the most recent traces are
+kept in a ring buffer on ``tracer``. ``metrics`` holds counters, gauges (last
+value set, e.g. a queue depth) and latency histograms, and
+``export_diagnostics`` writes all of it to a JSON file.
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import datetime
+import itertools
+import threading
+from collections import deque
+from pathlib import Path
+
+
+log = logging.getLogger("sparkle")
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+def configure_logging(level=None):
+    level = level or os.environ.get("SPARKLE_LOG_LEVEL", "INFO")
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("[%(levelname)s %(asctime)s.%(msecs)03d] %(message)s", "%H:%M:%S"))
+        log.addHandler(handler)
+        log.propagate = False
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; quantiles are reported as bucket upper bounds."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 1),
+            'p50_ms': round(self.quantile(0.5) * 1000, 1),
+            'p90_ms': round(self.quantile(0.9) * 1000, 1),
+            'p99_ms': round(self.quantile(0.99) * 1000, 1),
+            'max_ms': round(self.max * 1000, 1),
+        }
+
+
+class Metrics:
+    """Named counters, gauges and latency histograms, safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'histograms': {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+            }
+
+
+class Trace:
+    """Stage timeline of one request, timed from the event that triggered it.
+
+    Each stage reached feeds the ``stage.<name>`` histogram with its offset
+    from the start, and ``finish`` records the outcome once.
+    """
+    __slots__ = ('id', 'kind', 'started_at', 'wall_time', 'stages', 'outcome', 'duration', '_metrics')
+
+    def __init__(self, trace_id, kind, metrics, attrs):
+        self.id = trace_id
+        self.kind = kind
+        self.started_at = time.perf_counter()
+        self.wall_time = time.time()
+        self.stages = [('received', 0.0, attrs)]
+        self.outcome = None
+        self.duration = None
+        self._metrics = metrics
+
+    def mark(self, stage, **attrs):
+        elapsed = time.perf_counter() - self.started_at
+        self.stages.append((stage, elapsed, attrs))
+        self._metrics.observe(f"stage.{stage}", elapsed)
+
+    def finish(self, outcome, **attrs):
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        self.duration = time.perf_counter() - self.started_at
+        self.stages.append((outcome, self.duration, attrs))
+        self._metrics.incr(f"requests.{outcome}")
+        self._metrics.observe(f"request.{outcome}", self.duration)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'time': datetime.datetime.fromtimestamp(self.wall_time).isoformat(timespec='milliseconds'),
+            'outcome': self.outcome,
+            'duration_ms': None if self.duration is None else round(self.duration * 1000, 1),
+            'stages': [{'stage': stage, 'at_ms': round(at * 1000, 1), **attrs} for stage, at, attrs in self.stages],
+        }
+
+
+class _NullTrace:
+    """Stand-in handed out while tracing is disabled; every call is a no-op."""
+    outcome = None
+
+    def mark(self, stage, **attrs):
+        pass
+
+    def finish(self, outcome, **attrs):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Tracer:
+    """Starts traces and keeps the most recent ``capacity`` of them."""
+
+    def __init__(self, metrics, capacity=256, enabled=True):
+        self.metrics = metrics
+        self.enabled = enabled
+        self.traces = deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+
+    def start(self, kind, **attrs):
+        if not self.enabled:
+            return NULL_TRACE
+        trace = Trace(next(self._ids), kind, self.metrics, attrs)
+        self.traces.append(trace)
+        return trace
+
+    def recent(self):
+        return [trace.to_dict() for trace in list(self.traces)]
+
+
+metrics = Metrics()
+tracer = Tracer(metrics)
+
+
+def export_diagnostics(path, extra=None):
+    """Write metrics, recent traces and ``extra`` to ``path`` as JSON; returns the path."""
+    path = Path(path)
+    report = {
+        'exported_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'metrics': metrics.snapshot(),
+        'traces': tracer.recent(),
+        **(extra or {}),
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(path.suffix + ".tmp")
+    temporary.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    os.replace(temporary, path)
+    return path